@@ -1,50 +1,57 @@
-from flask import Flask, url_for, redirect, render_template, make_response, session, request,  jsonify, abort
-from flask_session import Session
-from pymongo import MongoClient
-from werkzeug.security import generate_password_hash, check_password_hash
+# The .env file is loaded before anything else: the modules below read their settings (cache size and Redis URL, rate limits, job
+# workers, ...) when they are imported
 from dotenv import load_dotenv
+load_dotenv()
+
+from flask import Flask, Response, url_for, redirect, render_template, make_response, session, request,  jsonify, abort
+from db import database, get_client
+from metrics import init_metrics, render_metrics
+from seed import generate as generate_dataset, import_file, progress_printer
+from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 # from utils.helpers import upload_file_to_s3
 import os
 from bson.objectid import ObjectId   
-import boto3
 import uuid
 import datetime
-from utils import get_user_by_id, get_favorites_by_ids, unlike_post_by_id
-from urllib.parse import urlparse
+import time
+import math
+from utils import get_user_by_id, gallery_page, migrate_saves, unlike_post_by_id, unsave_post_by_id, toggle_like, toggle_save, set_like, set_save, trending_score, refresh_scores, paginate, attach_authors, attach_post_states, get_post_states, get_liked_post_ids, get_saved_post_ids, migrate_likes, author_snapshot, propagate_author, backfill_author_snapshots
+from indexes import ensure_indexes, check_query_plans
+from storage import MAX_UPLOAD_SIZE, ALLOWED_IMAGE_TYPES, public_url, key_from_url, is_bucket_url, presigned_upload, uploaded_object, upload_stream, delete_later
+from images import process_post_image, post_image_keys
+from cleanup import delete_user_content, remove_post_references
+import jobs
+from search import search_page, post_search_fields, author_search_fields, backfill_search_fields
+import click
+from sessions import init_session
+from ratelimit import interaction_retry_after
+from events import start_change_stream
+from httpcache import conditional
+from models import CARD_PROJECTION, PROFILE_PROJECTION, post_cards
+from cache import cache, FEED_TTL, feed_key, likes_key, invalidate_user, invalidate_feeds, set_like_count, apply_like_counts
+# The debug toolbar is a development dependency (requirements-dev.txt), it is never installed or switched on in production
+try:
+    from flask_debugtoolbar import DebugToolbarExtension
+except ImportError:
+    DebugToolbarExtension = None
 
-# Initializes the flask application and loads the .env file to retreive information from the MongoDB Atlas Database
+# Initializes the flask application (the .env file with the MongoDB Atlas Database details was loaded at the top)
 app = Flask(__name__)
-load_dotenv()
 
 # This is to monitor Flask's session management. Flask uses a secret key to sign and encrypt session data to prevent tampering and ensure security. 
 # This secret key is essential for the proper functioning of user sessions in your Flask application.
 # This is essentially when users sign into their account, it simply creates a private session for them (for security and privacy reasons)
-sess = Session()
 app.secret_key = os.getenv('APP_SECRET_KEY')
-app.config['SESSION_TYPE'] = 'filesystem'
-sess.init_app(app)
-
-# AWS S3 Bucket Configuration 
-s3 = boto3.client('s3', region_name='us-east-1', 
-                  aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'), 
-                  aws_secret_access_key= os.getenv('AWS_SECRET_ACCESS_KEY'))
 
-# Checks that if the FLASK_ENV is in development, we switch on debugging
-if os.getenv('FLASK_ENV', 'development') =='development':
-    app.debug = True
+# Requests larger than the biggest allowed image are rejected before they are read
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
 
-# Establish a database connection with the MONGO_URI (MongoDB Atlas connection)
-client = MongoClient(os.getenv('MONGO_URI'))
-
-# Checks if the connection has been made, else make an error printout
-try:
-    client.admin.command('ping')          
-    database = client[os.getenv('MONGO_DBNAME')]          
-    print('* Connected to MongoDB!')         
+# Times every request and the MongoDB / S3 calls it makes, for /metrics and the slow request log
+init_metrics(app)
 
-except Exception as err:
-    print('* "Failed to connect to MongoDB at', os.getenv('MONGO_URI'))
-    print('Database connection error:', err) 
+# Sets up where the sessions are stored (see sessions.py): "filesystem" (default), "mongodb" or "cookie"
+init_session(app, database, os.getenv('SESSION_BACKEND', 'filesystem'))
 
 # Helper function for creatte() to generate unique filename for uploads
 def generate_unique_filename(original_filename):
@@ -52,35 +59,67 @@ def generate_unique_filename(original_filename):
     unique_filename = "{}-{}.{}".format(datetime.datetime.now().strftime('%Y%m%d%H%M%S'), uuid.uuid4(), extension) # The filename consists of the "timestamp_randomUUID.file extension)
     return unique_filename
 
+# Helper function which builds the explore feed query from the (optional) art type tag
+def feed_query(tag=None):
+    query = {}
+    if tag:
+        query['art_type'] = tag
+    return query
+
+# The explore feed can be sorted by newest first (the default) or by trending score
+FEED_SORTS = {'newest': 'created_at', 'trending': 'score'}
+
+# Helper function which returns a page of the explore feed: search results ranked by relevance if there is a search, otherwise the newest
+# (or trending) posts. Pages (with their authors' avatars) are cached for a short while, the like counts which changed since are patched in when they are read.
+# Posts are read as post cards (see models.py).
+def feed_page(search=None, tag=None, cursor=None, sort=None):
+    sort = sort if sort in FEED_SORTS else 'newest'
+
+    def load():
+        if search:
+            artworks, next_cursor = search_page(database.posts, search, tag, cursor)
+        else:
+            artworks, next_cursor = paginate(database.posts, feed_query(tag), cursor, field=FEED_SORTS[sort], projection=CARD_PROJECTION)
+        return post_cards(attach_authors(artworks)), next_cursor
+
+    artworks, next_cursor = cache.get_or_load(feed_key(search, tag, cursor, sort), load, FEED_TTL)
+
+    # The routes add the user's own like and save state to the posts, so they get copies of the cached posts
+    return apply_like_counts([artwork.copy() for artwork in artworks]), next_cursor
+
 # Routes: 
-# Default home route which will be the explore page         
+# Default home route which will be the explore page. Only the first page of posts is rendered, the rest is loaded by explore.js through /feed
+# With ?sort=trending the most liked and saved recent posts come first.
+# Browsers which already have the page get a 304 until a post is added or removed or a like count changes (see httpcache.py).
 @app.route('/')
+@conditional('feed', 'counts', per_user=True)
 def home(): 
-    artworks = list(database.posts.find({}).sort("created_at", -1))
-    
-    for artwork in artworks:
-        user_id = artwork.get('user_id', None)
-        if user_id:
-            try:
-                user_object_id = ObjectId(user_id)
-                user = database.users.find_one({'_id': user_object_id})
-                if user:
-                    artwork['avatar_url'] = user.get('avatar_url', None) 
-                    # print(f"User ID: {user_id} -> Avatar URL: {artwork['avatar_url']}")
-                else:
-                    print(f"No user found for User ID: {user_id}")
-            except Exception as e:
-                print(f"Error converting user_id {user_id} to ObjectId: {e}")
-        else:
-            print("No user_id field in this artwork.")
-    
-    return render_template('index.html', artworks=artworks)
+    sort = request.args.get('sort')
+    artworks, next_cursor = feed_page(cursor=request.args.get('cursor'), sort=sort)
+    attach_post_states(artworks, session.get('user_id'))
+    return render_template('index.html', artworks=artworks, next_cursor=next_cursor, sort=sort)
 
 
-# This route is for the search bar and it finds the posts that have the same title as the user searched for.
+# This route is used by the infinite scroll on the explore page, it returns the next page of post cards (for the current search or filter) as HTML
+@app.route('/feed', methods=['GET'])
+@conditional('feed', 'counts', per_user=True)
+def feed():
+    search = request.args.get('search')
+    tag = request.args.get('tag')
+    sort = request.args.get('sort')
+
+    artworks, next_cursor = feed_page(search, tag, request.args.get('cursor'), sort)
+    attach_post_states(artworks, session.get('user_id'))
+    return jsonify({'html': render_template('post_cards.html', artworks=artworks), 'next_cursor': next_cursor})
+
+
+# This route is for the search bar and it finds the posts whose title, description, art type or artist match what the user searched for, best match first.
+# Searching from a filtered page (the tag argument) only searches the posts of that art type.
 @app.route('/search', methods=['GET'])
 def search_posts():
     search_query = request.args.get('search')
+    tag = request.args.get('tag')
+    next_cursor = None
     
     # If the search query is a non-character value, we return nothing.
     if not search_query:
@@ -88,53 +127,68 @@ def search_posts():
         artworks = []
 
     else:
-        artworks = list(database.posts.find({'post_title': {'$regex': search_query, '$options': 'i'}}).sort("created_at", -1))
+        artworks, next_cursor = feed_page(search_query, tag, request.args.get('cursor'))
+        attach_post_states(artworks, session.get('user_id'))
         no_posts_found = len(artworks)==0  
 
-    return render_template('index.html', artworks=artworks, no_posts_found=no_posts_found)
+    return render_template('index.html', artworks=artworks, no_posts_found=no_posts_found, next_cursor=next_cursor, search=search_query, tag=tag)
 
-# This route is for the filter menu and it only retrieves artworks which have a certain tag.
+# This route is for the filter menu and it only retrieves artworks which have a certain tag (within the current search results if there is a search).
 @app.route('/filter/<tag>', methods=['GET'])
+@conditional('feed', 'counts', per_user=True)
 def filter_posts(tag):
-    artworks = list(database.posts.find({'art_type': tag}).sort("created_at", -1))
+    search_query = request.args.get('search')
+    sort = request.args.get('sort')
+    artworks, next_cursor = feed_page(search_query, tag, request.args.get('cursor'), sort)
+    attach_post_states(artworks, session.get('user_id'))
     no_posts_found = len(artworks)==0  
-    return render_template('index.html', artworks=artworks, no_posts_found=no_posts_found)
+    return render_template('index.html', artworks=artworks, no_posts_found=no_posts_found, next_cursor=next_cursor, search=search_query, tag=tag, sort=sort)
+
+# The state a like / save request asks for, e.g. ?liked=true. None if the request doesn't say, then the state is toggled.
+def parse_state(value):
+    if value is None:
+        return None
+    return value.lower() in ('1', 'true', 'on')
+
+def requested_state(name):
+    return parse_state(request.args.get(name))
+
+# Answers 429 Too Many Requests when the user or their address sent more likes / saves than the rate limits allow (see ratelimit.py)
+def rate_limited(user_id, button=None):
+    retry_after = interaction_retry_after(user_id, request.remote_addr, button)
+    if retry_after:
+        response = jsonify({'error': 'Too many requests', 'retry_after': round(retry_after, 2)})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        return response
+    return None
 
 # This route will allow the user to like a specific post in real time. 
 @app.route('/like_post/<post_id>', methods=['POST'])
 def like_post(post_id):
     try:
-        # Correctly formatting the post_id
-        post_id = ObjectId(post_id)
-
-        # Finding the post from the database and the user_id (in session)
-        post = database.posts.find_one({'_id': post_id})
         user_id = session.get('user_id')
 
+        limited = rate_limited(user_id, f"like:{post_id}")
+        if limited:
+            return limited
+
         # If the user is logged in they can like the posts, otherwise, it will redirect them to the login page. 
         if user_id:
-            # If the post is a valid post in the database it checks 
-            if post:
-                # Retrieve the array of users who liked the post from the database
-                users_that_like_post = post.get('users_that_like_post', [])
-
-                # If the user is not in the array of users that likes the post, this means they like the post and therefore are added to the array
-                # Likewise, if the user is in the array of users that likes the post, this means they want to unlike the post and are thus removed from this array
-                if user_id in users_that_like_post:
-                    users_that_like_post.remove(user_id)
-                    liked = False
-                else:
-                    users_that_like_post.append(user_id)
-                    liked = True
-
-                # Update the database
-                database.posts.update_one({'_id': post_id}, {'$set': {'likes': len(users_that_like_post), 'users_that_like_post': users_that_like_post}})
-
-                # Return the updated like count based on the number of people in the user_that_likes_post array
-                return jsonify({'likes': len(users_that_like_post), 'liked': liked})
+            # explore.js sends the state the user wants (?liked=true / false) once they stopped clicking, which is written only if it differs from the stored one.
+            # Without it the like is toggled: if the user has not liked the post yet it is liked, otherwise it is unliked.
+            # Both cases are one atomic update in the database which returns the updated like count.
+            liked = requested_state('liked')
+            result = toggle_like(post_id, user_id) if liked is None else set_like(post_id, user_id, liked)
+
+            # If the post is a valid post in the database it returns the updated like count 
+            if result:
+                likes, liked = result
+                set_like_count(post_id, likes)
+                return jsonify({'likes': likes, 'liked': liked})
 
             else:
-                return jsonify({'error': 'Post not found'}, 404)
+                return jsonify({'error': 'Post not found'}), 404
         
         elif user_id == None:
             return jsonify({'redirect': url_for('login')})
@@ -144,31 +198,24 @@ def like_post(post_id):
         return "Failed to like post", 500
 
 
-# This is a route for the explore page for the user to save posts into their favorites array which will therefore save the post to the gallery
+# This is a route for the explore page for the user to save posts which will therefore save the post to the gallery
 @app.route('/save_post/<post_id>', methods=['POST'])
 def save_post(post_id):
     try:
         # Check if the user is logged in
         user_id = session.get('user_id')
+        limited = rate_limited(user_id, f"save:{post_id}")
+        if limited:
+            return limited
+
         if user_id:
-            # Get the current user and their favoritees array
-            current_user = get_user_by_id(user_id)
-            favorites = current_user.get('favorites', [])
-            post_id = ObjectId(post_id)
-
-            # Check if the post is already in the user's favorites
-            if post_id in favorites:
-                favorites.remove(ObjectId(post_id))  # Remove the post from favorites
-                saved = False
-            else:
-                favorites.insert(0, ObjectId(post_id))  # Add the post to favorites
-                saved = True
-            
-            # Update the user's favorites array in the database
-            database.users.update_one({'_id': current_user['_id']}, {'$set': {'favorites': favorites}})
+            # The post is put in the state the user wants (?saved=true / false), or without it, if the post is already saved it is removed
+            # from the gallery, otherwise it is added to it
+            saved = requested_state('saved')
+            saved = toggle_save(user_id, post_id) if saved is None else set_save(user_id, post_id, saved)
             
             # Return a JSON response to indicate the post has been saved or removed
-            return jsonify({'favorites': list(map(lambda x: str(x), favorites)), 'saved': saved})
+            return jsonify({'saved': saved})
         
         elif user_id == None:
             return jsonify({'redirect': url_for('login')})
@@ -178,58 +225,83 @@ def save_post(post_id):
         return "Failed to save post", 500
 
 
+# This route returns the like count and whether the user liked / saved each post, for a comma separated list of post ids, in one response.
+# The explore page renders these states on the server, explore.js only calls this to refresh a page restored from the browser's cache.
+@app.route('/post_states', methods=['GET'])
+def post_states():
+    post_ids = [post_id for post_id in request.args.get('ids', '').split(',') if post_id][:100]
+    return jsonify({'states': get_post_states(post_ids, session.get('user_id'))})
+
+
+# The live like count stream (see events.py) is only served by the ASGI app, on its event loop. Here an open stream would hold one of the
+# few worker threads for as long as the page is open, so the Flask app answers 204, which tells the browser's EventSource not to reconnect
+# (explore.js then stops asking, and the counts are the ones the page was rendered with).
+@app.route('/events/likes', methods=['GET'])
+def like_events():
+    return '', 204
+
+
 # This route is loaded at the very beginning when the web page is loaded to remember which posts the user saved
 @app.route('/get_saved_posts', methods=['GET'])
+@conditional(per_user=True)
 def get_saved_posts():
     user_id = session.get('user_id')
     
     if user_id:
-        user = get_user_by_id(user_id)
-        favorites = user.get('favorites', [])
-        # Convert ObjectID to string for comparison
-        favorites = [str(fav) for fav in favorites]
-        return jsonify({'saved_posts': favorites, 'user_in_session': user_id})
+        # With ?ids=<comma separated post ids> only those posts are checked, which keeps the answer small for users with large galleries
+        post_ids = [ObjectId(post_id) for post_id in request.args.get('ids', '').split(',') if ObjectId.is_valid(post_id)]
+        if post_ids:
+            saved_posts = list(get_saved_post_ids(user_id, post_ids))
+        else:
+            saved_posts = [str(save['post_id']) for save in database.saves.find({'user_id': user_id}, {'_id': 0, 'post_id': 1}).sort('created_at', -1)]
+        return jsonify({'saved_posts': saved_posts, 'user_in_session': user_id})
     
     else:
         return jsonify({'saved_posts': []})
 
 
-# This route is loaded at the very beginning when the web page is loaded to remember which posts the user liked for the button
+# This route tells whether the user in session likes a post. The answer is the same size however many users like the post,
+# and the other users who like it are never sent to the browser.
 @app.route('/get_liked_posts/<post_id>', methods=['GET'])
 def get_liked_posts(post_id):
     user_id = session.get('user_id')
 
-    # Finding the post from the database and the user_id (in session)
-    post = database.posts.find_one({'_id': ObjectId(post_id)})
-
-    if user_id:
-        users_that_likes_posts = post.get('users_that_like_post', [])
-        return jsonify({'users_that_liked_post': users_that_likes_posts, 'user_in_session': user_id})
+    if user_id and ObjectId.is_valid(post_id):
+        liked = post_id in get_liked_post_ids(user_id, [ObjectId(post_id)])
+        return jsonify({'liked': liked, 'post_id': post_id})
     
     else:
-        return jsonify({'users_that_liked_post': [], 'post_id': post_id})
+        return jsonify({'liked': False, 'post_id': post_id})
 
 # Other user's page
 @app.route('/user/<username>', methods=['GET'])
+@conditional('feed', 'counts')
 def user_profile(username):
     # Fetch the user based on the username
-    user = database.users.find_one({'username': username})
-
-    user_posts = database.posts.find({"username":username}).sort("created_at", -1)
+    user = database.users.find_one({'username': username}, PROFILE_PROJECTION)
 
     if not user:
         # No user found, return 404 or redirect
         abort(404)
 
-    return render_template('user.html', user=user, user_posts=user_posts)
+    # Posts are found by their author's id rather than by the username copied onto them, which is updated in the background
+    user_posts, next_cursor = paginate(database.posts, {"user_id":f"{user['_id']}"}, request.args.get('cursor'), projection=CARD_PROJECTION)
+
+    return render_template('user.html', user=user, user_posts=post_cards(user_posts), next_cursor=next_cursor)
 
 
 # This route is loaded at the very beginning when the web page is loaded to display which posts have how many likes at the start
 @app.route('/get_like_count/<post_id>', methods=['GET'])
+@conditional('counts', public=True)
 def get_like_count(post_id):
     try:
+        # The like count of a recently liked post is already in the cache
+        likes = cache.get(likes_key(post_id))
+        if likes is not None:
+            return jsonify({'likes': likes})
+
         # Retrieve the post from the database
-        post = database.posts.find_one({'_id': ObjectId(post_id)})
+        post = database.posts.find_one({'_id': ObjectId(post_id)}, {'likes': 1})
         
         if post:
             # Get the like count from the post
@@ -242,6 +314,23 @@ def get_like_count(post_id):
         return jsonify({'likes': 0})
 
 
+# Route which gives the browser a presigned URL to upload the photo it took or picked straight to the AWS S3 Bucket,
+# so the image is never sent through (and held in the memory of) the Flask worker.
+@app.route('/upload_url', methods=['POST'])
+def upload_url():
+    if 'user_id' not in session:
+        return jsonify({'redirect': url_for('login')})
+
+    # Only images can be uploaded, the extension of the file follows its type
+    content_type = (request.get_json(silent=True) or {}).get('content_type')
+    if content_type not in ALLOWED_IMAGE_TYPES:
+        return jsonify({'error': 'Unsupported image type'}), 400
+
+    file_name = generate_unique_filename(f"image.{ALLOWED_IMAGE_TYPES[content_type]}")
+    session['pending_upload_key'] = file_name
+    return jsonify({'key': file_name, 'upload': presigned_upload(file_name, content_type)})
+
+
 # Route to upload a photo or take a photo 
 @app.route('/create', methods=['POST', 'GET'])
 def create():
@@ -255,17 +344,15 @@ def create():
         if request.is_json:
             data = request.get_json()
 
-            # If the data is an image: 
-            if 'image' in data:
-                import base64
-                image_data = base64.b64decode(data['image'].split(",")[-1]) # Decodes the base64-encoded image data (removes anything not needed)
-                file_name = generate_unique_filename("image.jpg")           # Generates a unique filename for the image. 
-                
-                # Uploads the image as a jpeg to the AWS S3 Bucket, based on the BUCKET_NAME. 
-                s3.put_object(Bucket=os.getenv('BUCKET_NAME'), Key=file_name, Body=image_data, ContentType='image/jpeg')
-                
+            # If the browser finished uploading the image to the AWS S3 Bucket with the URL from /upload_url: 
+            if 'key' in data:
+                # We only accept the file this session was allowed to upload, once it actually exists in the bucket
+                if data['key'] != session.get('pending_upload_key') or not uploaded_object(data['key']):
+                    return jsonify({'error': 'Image not uploaded'}), 400
+
                 # Update session variables
-                session['uploaded_file_key'] = file_name
+                session.pop('pending_upload_key', None)
+                session['uploaded_file_key'] = data['key']
                 session['image_viewed'] = False 
                 session['image_on_post_page'] = False
 
@@ -285,10 +372,9 @@ def gallery():
 
         # If the user has logged in, then we can do the following
         if user_id:
-            # We essentially get the current_user's favorite array and passes these details to the gallery.html page. 
-            current_user = get_user_by_id(user_id)
-            favorites = list(get_favorites_by_ids(current_user.get('favorites')))
-            return render_template('gallery.html', favorites=favorites, get_user_by_id=get_user_by_id)
+            # We get one page of the posts the user saved (most recently saved first) and pass them to the gallery.html page. 
+            favorites, next_cursor = gallery_page(user_id, request.args.get('cursor'))
+            return render_template('gallery.html', favorites=favorites, next_cursor=next_cursor)
         return redirect(url_for('login'))
     
     except Exception as e:
@@ -302,11 +388,11 @@ def unlike_post(post_id):
         user_id = session.get('user_id')
         if user_id:
             # update user's like
-            current_user = get_user_by_id(user_id)
-            if current_user.get('favorites') is not None and ObjectId(post_id) in current_user['favorites']:
-                database['users'].update_one({'_id': ObjectId(user_id)}, {'$pull': {'favorites': ObjectId(post_id)}})
+            unsave_post_by_id(post_id, user_id)
             # update post's like
-            unlike_post_by_id(post_id)
+            post = unlike_post_by_id(post_id, user_id)
+            if post:
+                set_like_count(post_id, post['likes'])
 
         return redirect(url_for('login'))
     
@@ -324,7 +410,7 @@ def post():
             abort(400, description="Image not found in session")
 
         # Else, we create a URL for the image: through the BUCKET_NAME and the uploaded_file_key session variable (which is the filename)
-        image_url = f"https://{os.getenv('BUCKET_NAME')}.s3.amazonaws.com/{session['uploaded_file_key']}"
+        image_url = public_url(session['uploaded_file_key'])
 
         session['image_viewed'] = True
         return render_template('post.html', image_url=image_url) # We pass the image URL to the html page to paste it on the front page to let the user confirm it.
@@ -346,16 +432,21 @@ def post_data():
         post_description = request.form.get('post_description')
         post_title = request.form.get('post_title')
         image_type = request.form.get('image_type')
-        image_url = session.get('uploaded_file_key', None)
+        image_key = session.get('uploaded_file_key', None)
+        image_url = None
         
-        # If the image_url is valid, we update the image_url to its filename
-        if image_url:
-            image_url = f"https://{os.getenv('BUCKET_NAME')}.s3.amazonaws.com/{image_url}"
+        # If the image key is valid, we build the image_url from it
+        if image_key:
+            image_url = public_url(image_key)
         
         # We create a post document to upload to the mongoDB atlas database
+        # The post keeps a copy of its author's username and avatar so the feeds don't have to look up the user
+        author = author_snapshot((user_id and get_user_by_id(user_id)) or {'username': username})
+
         post = {
             "user_id": user_id, 
-            "username": username,
+            "username": author['username'],
+            "avatar_url": author['avatar_url'],
             "likes": 0,
             "post_title": post_title, 
             "post_description": post_description,
@@ -364,8 +455,21 @@ def post_data():
             "created_at": datetime.datetime.utcnow()  
         }
 
+        # The post starts with no likes or saves, its trending score is then kept up to date by like_post() and save_post()
+        post.update({"saves": 0, "score": trending_score(0, 0, post["created_at"])})
+
+        # The word prefixes used by the search bar
+        post.update(post_search_fields(post_title, image_type))
+        post.update(author_search_fields(username))
+
         # We insert the page and then redirect to the home page. 
-        posts_collection.insert_one(post)
+        result = posts_collection.insert_one(post)
+        invalidate_feeds()
+
+        # The smaller copies of the image shown in the feeds are made in the background so the user doesn't wait for them
+        if image_key:
+            jobs.submit(process_post_image, result.inserted_id, image_key)
+
         return redirect(url_for('home'))
     
     except Exception as e:
@@ -375,7 +479,7 @@ def post_data():
 # Route to delete image
 @app.route('/delete_image', methods=['POST'])
 def delete_image():
-    s3.delete_object(Bucket=os.getenv('BUCKET_NAME'), Key=session['uploaded_file_key'])
+    delete_later(session['uploaded_file_key'])
     del session['uploaded_file_key']  
     session['image_on_post_page'] = False
     return redirect(url_for('create')) 
@@ -386,13 +490,10 @@ def profile():
     # This checks that if the user in the session has an ID (meaning they have an account in the webapp, then they can access their profile page)
     if 'user_id' in session: 
         user_id = ObjectId(session['user_id'])
-        user = database.users.find_one({'_id': user_id})
-        user_posts = database.posts.find({"user_id":f"{user_id}"}).sort("created_at", -1)
+        user = database.users.find_one({'_id': user_id}, PROFILE_PROJECTION)
+        user_posts, next_cursor = paginate(database.posts, {"user_id":f"{user_id}"}, request.args.get('cursor'), projection=CARD_PROJECTION)
 
-        if not user_posts:
-            return render_template('profile.html', user=user, user_posts=[])
-        else:
-            return render_template('profile.html', user=user, user_posts=user_posts)
+        return render_template('profile.html', user=user, user_posts=post_cards(user_posts), next_cursor=next_cursor)
 
     # Else, if they don't have an account, it will redirect them to the login page
     else: 
@@ -428,14 +529,13 @@ def edit_profile():
 
                     database.users.update_one(filter, update)
 
-                    filt = {'user_id': f"{user_id}"}
-
-                    upd = {'$set': {'username': f"{new_username}"}}
-
-                    database.posts.update_many(filt, upd)
+                    # The new username is copied onto the user's posts in the background (the feeds are refreshed once that is done)
+                    jobs.submit(propagate_author, user_id, {'username': f"{new_username}", **author_search_fields(new_username)})
 
                     session.update({"username": new_username})
 
+                    invalidate_user(user_id)
+
                     return redirect(url_for('profile'))    
                 
         return render_template('edit_profile.html', user=user)      
@@ -454,16 +554,14 @@ def delete_account():
         return "User not found", 404
 
     try:
-        avatar_url = user.get('avatar_url')
-        if avatar_url:
-            parsed_url = urlparse(avatar_url)
-            avatar_key = parsed_url.path.lstrip('/')
-            s3.delete_object(Bucket=os.getenv('BUCKET_NAME'), Key=avatar_key)
-
+        # The account is deleted right away, its avatar, posts, images, likes and saves are cleaned up in the background
         database.users.delete_one({'_id': user_id})
+        invalidate_user(user_id)
         session.pop('user_id', None)
         session.pop('uploaded_file_key', None)
 
+        jobs.submit(delete_user_content, user_id, user.get('avatar_url'))
+
         return redirect(url_for('home', message="Account successfully deleted."))
 
     except Exception as e:
@@ -480,9 +578,13 @@ def delete_post(post_id):
         if not post:
             return "Post not found", 404
 
-        image_key = post['image_url'].split(f"https://{os.getenv('BUCKET_NAME')}.s3.amazonaws.com/")[-1]
-        s3.delete_object(Bucket=os.getenv('BUCKET_NAME'), Key=image_key)
         posts_collection.delete_one({'_id': ObjectId(post_id)})
+        invalidate_feeds()
+        cache.delete(likes_key(post_id))
+
+        # The images are deleted from the AWS S3 Bucket and the post's likes and saves are removed in the background
+        delete_later(*post_image_keys(post))
+        jobs.submit(remove_post_references, [post['_id']])
 
         # Redirect back to profile page
         return redirect(url_for('profile'))
@@ -506,29 +608,32 @@ def update_pp():
     if file.filename == '':
         return "No selected file", 400
 
+    if file.mimetype not in ALLOWED_IMAGE_TYPES:
+        return "Unsupported image type", 400
+
     try:
         # If there's an existing profile picture, delete it from S3
         old_avatar_url = user.get('avatar_url')
-        if old_avatar_url:
-            parsed_url = urlparse(old_avatar_url)
-            old_avatar_key = parsed_url.path.lstrip('/')
-            s3.delete_object(Bucket=os.getenv('BUCKET_NAME'), Key=old_avatar_key)
+        if old_avatar_url and is_bucket_url(old_avatar_url):
+            delete_later(key_from_url(old_avatar_url))
 
-        # Upload the new image to AWS S3
-        image_data = file.read()
+        # Upload the new image to AWS S3. The file is streamed to the bucket in parts rather than read into memory.
         file_name = generate_unique_filename(file.filename)
-
-        s3.put_object(Bucket=os.getenv('BUCKET_NAME'), Key=file_name, Body=image_data, ContentType='image/jpeg')
+        upload_stream(file.stream, file_name, file.mimetype)
 
         # Save the new image URL to MongoDB
         session['uploaded_file_key'] = file_name
-        image_url = f"https://{os.getenv('BUCKET_NAME')}.s3.amazonaws.com/{session['uploaded_file_key']}"
+        image_url = public_url(session['uploaded_file_key'])
 
         filter = {'_id': user_id}
         update = {'$set': {'avatar_url': f"{image_url}"}}
         collection = database['users']
         collection.update_one(filter, update)
 
+        # The new avatar is copied onto the user's posts in the background (the feeds are refreshed once that is done)
+        jobs.submit(propagate_author, user_id, {'avatar_url': image_url})
+        invalidate_user(user_id)
+
         return redirect(url_for('profile'))
 
     except Exception:
@@ -592,7 +697,6 @@ def signup():
                 'username': username,
                 'password': password_hash,
                 'email': email,
-                'favorites': [],
                 'avatar_url': "https://i.stack.imgur.com/l60Hf.png"
             })
 
@@ -704,6 +808,156 @@ def bad_request(e):
 def internal_server_error(e):
     return render_template('error.html', message=e.description), 500
 
-# Executing the Flask Application: 
+# Liveness probe: the process is up and serving requests. It never touches the database, so a slow database doesn't get workers restarted.
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({'status': 'ok'})
+
+# Readiness probe: the app can reach MongoDB. The result of the ping is reused for READY_TTL seconds, so frequent probes (one per
+# load balancer, per worker) don't add a database round trip each.
+READY_TTL = 5
+readiness = {'checked_at': None, 'ready': False, 'error': None}
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    now = time.monotonic()
+    if readiness['checked_at'] is None or now - readiness['checked_at'] >= READY_TTL:
+        try:
+            get_client().admin.command('ping')
+            readiness.update(ready=True, error=None)
+        except Exception as err:
+            readiness.update(ready=False, error=str(err))
+        readiness['checked_at'] = now
+
+    if not readiness['ready']:
+        return jsonify({'status': 'unavailable', 'error': readiness['error']}), 503
+    return jsonify({'status': 'ok'})
+
+# Request, MongoDB, S3 and template timings and the app's other figures in the Prometheus text format (see metrics.py)
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Returns the cache's hit and miss counters per kind of entry (feed pages, users, like counts)
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(cache.stats())
+
+# Command line tools for the database indexes:
+# `flask ensure-indexes` creates any missing index and `flask check-indexes` fails if a route's query would scan the whole collection or sort in memory
+@app.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    failed = ensure_indexes(database)
+    if failed:
+        raise SystemExit(1)
+    click.echo('All indexes are in place.')
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    problems = check_query_plans(database)
+    for name, stages in problems:
+        click.echo(f"{name}: {', '.join(stages)}")
+    if problems:
+        raise SystemExit(1)
+    click.echo('Every query is served by an index.')
+
+# `flask backfill-search` adds the search fields to posts which were created before search was added
+@app.cli.command('backfill-search')
+def backfill_search_command():
+    updated = backfill_search_fields(database.posts)
+    click.echo(f"Added search fields to {updated} posts.")
+
+# `flask backfill-authors` adds the author snapshot (username and avatar) to posts which were created before it was stored on posts
+@app.cli.command('backfill-authors')
+def backfill_authors_command():
+    updated = backfill_author_snapshots()
+    click.echo(f"Added the author snapshot to {updated} posts.")
+
+# `flask migrate-likes` moves the likes stored in the posts' users_that_like_post arrays into the likes collection
+@app.cli.command('migrate-likes')
+def migrate_likes_command():
+    migrated = migrate_likes()
+    click.echo(f"Migrated the likes of {migrated} posts.")
+
+# `flask refresh-scores` recomputes the saves counters and trending scores of all posts (e.g. from a daily cron job, or once for older posts)
+@app.cli.command('refresh-scores')
+def refresh_scores_command():
+    refresh_scores()
+    click.echo('Trending scores refreshed.')
+
+# `flask migrate-saves` moves the posts saved in the users' favorites arrays into the saves collection
+@app.cli.command('migrate-saves')
+def migrate_saves_command():
+    migrated = migrate_saves()
+    click.echo(f"Migrated the saved posts of {migrated} users.")
+
+# `flask seed generate` fills the database with synthetic users, posts, likes and saves (and uploads placeholder images) for capacity
+# testing and local environments, `flask seed import <collection> <file>` loads a JSON Lines export into a collection (see seed.py)
+@app.cli.group('seed')
+def seed_command():
+    pass
+
+@seed_command.command('generate')
+@click.option('--users', default=1000, help='Number of users.')
+@click.option('--posts', default=10000, help='Number of posts.')
+@click.option('--likes', default=3.0, help='Average number of likes per post.')
+@click.option('--saves', default=1.0, help='Average number of saves per post.')
+@click.option('--images', default=0, help='Number of placeholder images uploaded to the bucket and shared by the posts.')
+@click.option('--batch-size', default=1000, help='Documents per insert.')
+@click.option('--upload-workers', default=16, help='Images uploaded at the same time.')
+@click.option('--legacy', is_flag=True, help='Store likes and saves in the users_that_like_post / favorites arrays of older versions.')
+@click.option('--seed', default=0, help='Random seed, the same seed generates the same data.')
+def seed_generate_command(users, posts, likes, saves, images, batch_size, upload_workers, legacy, seed):
+    started_at = time.monotonic()
+    counts = generate_dataset(database, users, posts, likes, saves, images, batch_size, legacy, seed, upload_workers,
+                              progress_printer(click.echo))
+    invalidate_feeds()
+    click.echo(f"Inserted {', '.join(f'{count} {name}' for name, count in counts.items())} in {time.monotonic() - started_at:.1f} s.")
+    if legacy:
+        click.echo('Run `flask migrate-likes` and `flask migrate-saves` to move the likes and saves into their collections.')
+
+@seed_command.command('import')
+@click.argument('collection')
+@click.argument('file', type=click.File('r'))
+@click.option('--batch-size', default=1000, help='Documents per insert.')
+def seed_import_command(collection, file, batch_size):
+    inserted = import_file(database[collection], file, batch_size, progress_printer(click.echo))
+    invalidate_feeds()
+    click.echo(f"Inserted {inserted} documents into {collection}.")
+
+# Debugging (and the debug toolbar) is only ever switched on when FLASK_ENV is explicitly set to "development"
+def is_development():
+    return os.getenv('FLASK_ENV') == 'development'
+
+# The process which already ran the startup tasks, so that they run once in every worker process of a pre-forking server
+startup_pid = None
+
+# Work that must not hold up starting the app: makes sure every index the routes rely on exists, and follows the like counts written
+# by other processes when LIKE_EVENTS_CHANGE_STREAM is set (see events.py). The MongoDB connection (see db.py)
+# is opened by the first query of each process, so this runs in the background and the app starts without waiting on the database.
+def start_background_tasks():
+    global startup_pid
+    if startup_pid == os.getpid():
+        return
+    startup_pid = os.getpid()
+    jobs.submit(ensure_indexes, database)
+    start_change_stream(database)
+
+# Application factory used by every way of serving the app: `gunicorn -c gunicorn.conf.py "app:create_app()"` in production and
+# `flask --app "app:create_app()" run` or `python app.py` in development
+def create_app():
+    app.debug = is_development()
+    # Behind PROXY_COUNT reverse proxies (e.g. a load balancer) the client's address is taken from X-Forwarded-For, for the rate limits
+    if os.getenv('PROXY_COUNT') and not isinstance(app.wsgi_app, ProxyFix):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv('PROXY_COUNT')), x_proto=1)
+    if app.debug and DebugToolbarExtension is not None and 'debugtoolbar' not in app.extensions:
+        app.config.setdefault('DEBUG_TB_INTERCEPT_REDIRECTS', False)
+        app.extensions.setdefault('debugtoolbar', DebugToolbarExtension(app))
+    elif not app.debug:
+        app.config['DEBUG_TB_ENABLED'] = False
+    start_background_tasks()
+    return app
+
+# Executing the Flask Application (development server only, see create_app):
 if(__name__ == "__main__"):
-    app.run(debug=True)
+    create_app().run()
@@ -0,0 +1,198 @@
+# Like app.py, the .env file is loaded before the modules which read their settings when they are imported
+from dotenv import load_dotenv
+load_dotenv()
+
+from a2wsgi import WSGIMiddleware
+from flask import request as flask_request, url_for
+from flask.sessions import SecureCookieSessionInterface
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from bson.objectid import ObjectId
+import math
+import os
+import time
+
+import async_utils
+from app import create_app, parse_state
+from cache import cache, likes_key, set_like_count
+from db import get_async_database
+from events import async_like_count_stream, subscribed_post_ids
+from httpcache import cache_headers, not_modified, validators, version_names
+from metrics import observe_request
+from ratelimit import interaction_retry_after
+from sessions import MongoSessionInterface
+
+# ASGI entry point: `uvicorn asgi:app` or `gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app`.
+# The small JSON endpoints the explore page calls on every interaction (liking, saving, like counts) and the like count stream are served here on the event loop
+# with the async MongoDB driver, so waiting on the database doesn't hold a thread and one process can keep thousands of them in flight.
+# Every other route is the Flask app, which runs on a pool of ASGI_WSGI_THREADS threads.
+
+flask_app = create_app()
+
+with flask_app.test_request_context():
+    LOGIN_URL = url_for('login')
+
+# Reads the session with Flask's own session interface (used for the cookie and filesystem backends)
+def flask_session_user_id(cookie_header):
+    with flask_app.test_request_context(headers={'Cookie': cookie_header}):
+        session = flask_app.session_interface.open_session(flask_app, flask_request)
+        return session.get('user_id') if session else None
+
+# Returns the id of the user logged in with the request's session cookie, or None.
+# MongoDB sessions are loaded with the async driver, cookie sessions are only decoded and Flask-Session's files are read in a worker thread.
+async def session_user_id(request):
+    interface = flask_app.session_interface
+    signed_sid = request.cookies.get(interface.get_cookie_name(flask_app))
+    if not signed_sid:
+        return None
+
+    if isinstance(interface, MongoSessionInterface):
+        sid = interface.session_id(flask_app, signed_sid)
+        if not sid:
+            return None
+        document = await get_async_database()[interface.collection_name].find_one(interface.session_filter(sid), {'data.user_id': 1})
+        return document.get('data', {}).get('user_id') if document else None
+
+    if isinstance(interface, SecureCookieSessionInterface):
+        return flask_session_user_id(request.headers['cookie'])
+    return await run_in_threadpool(flask_session_user_id, request.headers['cookie'])
+
+# The same endpoints as the routes of app.py, with the same responses and rate limits
+
+# Behind PROXY_COUNT reverse proxies the client's address is read from X-Forwarded-For, the same way ProxyFix does it for the Flask app:
+# the address added by the outermost trusted proxy. Without enough entries the connection's address is used.
+PROXY_COUNT = int(os.getenv('PROXY_COUNT') or 0)
+
+def client_ip(request):
+    if PROXY_COUNT:
+        forwarded = [value.strip() for value in request.headers.get('x-forwarded-for', '').split(',') if value.strip()]
+        if len(forwarded) >= PROXY_COUNT:
+            return forwarded[-PROXY_COUNT]
+    return request.client.host if request.client else None
+
+def rate_limited(request, user_id, button=None):
+    retry_after = interaction_retry_after(user_id, client_ip(request), button)
+    if retry_after:
+        return JSONResponse({'error': 'Too many requests', 'retry_after': round(retry_after, 2)}, status_code=429,
+                            headers={'Retry-After': str(math.ceil(retry_after))})
+    return None
+
+async def like_post(request):
+    post_id = request.path_params['post_id']
+    try:
+        user_id = await session_user_id(request)
+        limited = rate_limited(request, user_id, f"like:{post_id}")
+        if limited:
+            return limited
+        if not user_id:
+            return JSONResponse({'redirect': LOGIN_URL})
+
+        liked = parse_state(request.query_params.get('liked'))
+        result = await (async_utils.toggle_like(post_id, user_id) if liked is None else async_utils.set_like(post_id, user_id, liked))
+        if result:
+            likes, liked = result
+            await async_utils.call_cache(set_like_count, post_id, likes)
+            return JSONResponse({'likes': likes, 'liked': liked})
+        return JSONResponse({'error': 'Post not found'}, status_code=404)
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return PlainTextResponse("Failed to like post", status_code=500)
+
+async def save_post(request):
+    post_id = request.path_params['post_id']
+    try:
+        user_id = await session_user_id(request)
+        limited = rate_limited(request, user_id, f"save:{post_id}")
+        if limited:
+            return limited
+        if not user_id:
+            return JSONResponse({'redirect': LOGIN_URL})
+
+        saved = parse_state(request.query_params.get('saved'))
+        saved = await (async_utils.toggle_save(user_id, post_id) if saved is None else async_utils.set_save(user_id, post_id, saved))
+        return JSONResponse({'saved': saved})
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return PlainTextResponse("Failed to save post", status_code=500)
+
+# Answers with a 304 if the browser's copy is still current, otherwise awaits respond() and adds the validators to its response (see httpcache.py)
+async def conditional_response(request, respond, names=(), user_id=None, per_user=False, public=False):
+    etag, last_modified = await async_utils.call_cache(validators, f"{request.url.path}?{request.url.query}",
+                                                       version_names(names, user_id, per_user), user_id)
+    headers = cache_headers(etag, last_modified, user_id, public)
+    if not_modified(request.headers.get('if-none-match'), request.headers.get('if-modified-since'), etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    response = await respond()
+    if response.status_code == 200:
+        response.headers.update(headers)
+    return response
+
+async def get_saved_posts(request):
+    user_id = await session_user_id(request)
+
+    async def respond():
+        if not user_id:
+            return JSONResponse({'saved_posts': []})
+
+        post_ids = [ObjectId(post_id) for post_id in request.query_params.get('ids', '').split(',') if ObjectId.is_valid(post_id)]
+        if post_ids:
+            saved_posts = list(await async_utils.get_saved_post_ids(user_id, post_ids))
+        else:
+            saved_posts = await async_utils.get_all_saved_post_ids(user_id)
+        return JSONResponse({'saved_posts': saved_posts, 'user_in_session': user_id})
+    return await conditional_response(request, respond, user_id=user_id, per_user=True)
+
+async def get_liked_posts(request):
+    post_id = request.path_params['post_id']
+    user_id = await session_user_id(request)
+    if user_id and ObjectId.is_valid(post_id):
+        liked = post_id in await async_utils.get_liked_post_ids(user_id, [ObjectId(post_id)])
+        return JSONResponse({'liked': liked, 'post_id': post_id})
+    return JSONResponse({'liked': False, 'post_id': post_id})
+
+async def get_like_count(request):
+    post_id = request.path_params['post_id']
+
+    async def respond():
+        try:
+            likes = await async_utils.call_cache(cache.get, likes_key(post_id))
+            if likes is None:
+                likes = await async_utils.get_like_count(post_id)
+            return JSONResponse({'likes': likes})
+
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            return JSONResponse({'likes': 0})
+    return await conditional_response(request, respond, ('counts',), public=True)
+
+# The like count stream is served on the event loop, so an open stream doesn't hold a thread and it stays open for as long as the page does
+async def like_events(request):
+    post_ids = subscribed_post_ids(request.query_params.get('ids'))
+    return StreamingResponse(async_like_count_stream(post_ids), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Times the endpoints served here for /metrics, the Flask app times its own routes. Routes are labelled the way Flask writes them.
+def timed(path, endpoint):
+    route = path.replace('{', '<').replace('}', '>')
+
+    async def timed_endpoint(request):
+        started_at = time.perf_counter()
+        response = await endpoint(request)
+        observe_request(route, request.method, response.status_code, time.perf_counter() - started_at)
+        return response
+    return timed_endpoint
+
+app = Starlette(routes=[
+    Route('/like_post/{post_id}', timed('/like_post/{post_id}', like_post), methods=['POST']),
+    Route('/save_post/{post_id}', timed('/save_post/{post_id}', save_post), methods=['POST']),
+    Route('/get_saved_posts', timed('/get_saved_posts', get_saved_posts), methods=['GET']),
+    Route('/get_liked_posts/{post_id}', timed('/get_liked_posts/{post_id}', get_liked_posts), methods=['GET']),
+    Route('/get_like_count/{post_id}', timed('/get_like_count/{post_id}', get_like_count), methods=['GET']),
+    Route('/events/likes', timed('/events/likes', like_events), methods=['GET']),
+    Mount('/', WSGIMiddleware(flask_app, workers=int(os.getenv('ASGI_WSGI_THREADS', 10))))
+])
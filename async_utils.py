@@ -0,0 +1,123 @@
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from bson.objectid import ObjectId
+from starlette.concurrency import run_in_threadpool
+import datetime
+
+from db import get_async_database
+from cache import cache, record_interaction
+from events import publish_like_count
+from utils import counter_update
+
+# The like and save engine of utils.py on the async MongoDB driver (Motor), for the endpoints of the ASGI app (asgi.py).
+# The documents, indexes and counter updates are the same, so both apps can serve the same database side by side.
+
+# Calls a function of the cache (cache.py). With the shared tier configured it is a blocking call to Redis, which is run in a thread so
+# the event loop isn't held up. The in-process tier alone is a dict lookup, which is simply called.
+async def call_cache(function, *args):
+    if cache.shared is None:
+        return function(*args)
+    return await run_in_threadpool(function, *args)
+
+async def like_post_by_id(post_id, user_id):
+    database = get_async_database()
+    try:
+        await database['likes'].insert_one({'user_id': user_id, 'post_id': ObjectId(post_id), 'created_at': datetime.datetime.utcnow()})
+    except DuplicateKeyError:
+        # The user already likes this post
+        return None
+
+    post = await database['posts'].find_one_and_update({'_id': ObjectId(post_id)}, counter_update('likes', 1), projection={'likes': 1}, return_document=ReturnDocument.AFTER)
+    if post is None:
+        await database['likes'].delete_one({'user_id': user_id, 'post_id': ObjectId(post_id)})
+    else:
+        await call_cache(record_interaction, user_id)
+        publish_like_count(post_id, post['likes'])
+    return post
+
+async def unlike_post_by_id(post_id, user_id):
+    database = get_async_database()
+    if (await database['likes'].delete_one({'user_id': user_id, 'post_id': ObjectId(post_id)})).deleted_count == 0:
+        # The user doesn't like this post
+        return None
+    post = await database['posts'].find_one_and_update({'_id': ObjectId(post_id)}, counter_update('likes', -1), projection={'likes': 1}, return_document=ReturnDocument.AFTER)
+    if post is not None:
+        await call_cache(record_interaction, user_id)
+        publish_like_count(post_id, post['likes'])
+    return post
+
+# Likes the post if the user hasn't liked it yet, otherwise unlikes it. Returns (likes, liked), or None if the post doesn't exist.
+async def toggle_like(post_id, user_id):
+    post = await like_post_by_id(post_id, user_id)
+    if post:
+        return post['likes'], True
+
+    post = await unlike_post_by_id(post_id, user_id)
+    if post:
+        return post['likes'], False
+
+    return None
+
+async def set_like(post_id, user_id, liked):
+    post = await (like_post_by_id(post_id, user_id) if liked else unlike_post_by_id(post_id, user_id))
+    if post is None:
+        post = await get_async_database()['posts'].find_one({'_id': ObjectId(post_id)}, {'likes': 1})
+        if post is None:
+            return None
+    return post.get('likes', 0), liked
+
+async def save_post_by_id(post_id, user_id):
+    database = get_async_database()
+    try:
+        await database['saves'].insert_one({'user_id': user_id, 'post_id': ObjectId(post_id), 'created_at': datetime.datetime.utcnow()})
+    except DuplicateKeyError:
+        return None
+
+    post = await database['posts'].find_one_and_update({'_id': ObjectId(post_id)}, counter_update('saves', 1), projection={'saves': 1}, return_document=ReturnDocument.AFTER)
+    if post is None:
+        await database['saves'].delete_one({'user_id': user_id, 'post_id': ObjectId(post_id)})
+    else:
+        await call_cache(record_interaction, user_id)
+    return post
+
+async def unsave_post_by_id(post_id, user_id):
+    database = get_async_database()
+    if (await database['saves'].delete_one({'user_id': user_id, 'post_id': ObjectId(post_id)})).deleted_count == 0:
+        return None
+    post = await database['posts'].find_one_and_update({'_id': ObjectId(post_id)}, counter_update('saves', -1), projection={'saves': 1}, return_document=ReturnDocument.AFTER)
+    await call_cache(record_interaction, user_id)
+    return post
+
+# Saves the post if the user hasn't saved it yet, otherwise removes it from their gallery. Returns whether the post is now saved.
+async def toggle_save(user_id, post_id):
+    if await save_post_by_id(post_id, user_id) is not None:
+        return True
+    await unsave_post_by_id(post_id, user_id)
+    return False
+
+async def set_save(user_id, post_id, saved):
+    if not saved:
+        await unsave_post_by_id(post_id, user_id)
+        return False
+    if await save_post_by_id(post_id, user_id) is not None:
+        return True
+    # Already saved, unless the post doesn't exist
+    return bool(await get_saved_post_ids(user_id, [ObjectId(post_id)]))
+
+# Returns which of the given post ids the user likes / saved, answered from the (user_id, post_id) indexes alone
+async def get_liked_post_ids(user_id, post_ids):
+    cursor = get_async_database()['likes'].find({'user_id': user_id, 'post_id': {'$in': list(post_ids)}}, {'_id': 0, 'post_id': 1})
+    return {str(like['post_id']) async for like in cursor}
+
+async def get_saved_post_ids(user_id, post_ids):
+    cursor = get_async_database()['saves'].find({'user_id': user_id, 'post_id': {'$in': list(post_ids)}}, {'_id': 0, 'post_id': 1})
+    return {str(save['post_id']) async for save in cursor}
+
+# Every post the user saved, most recently saved first
+async def get_all_saved_post_ids(user_id):
+    cursor = get_async_database()['saves'].find({'user_id': user_id}, {'_id': 0, 'post_id': 1}).sort('created_at', -1)
+    return [str(save['post_id']) async for save in cursor]
+
+async def get_like_count(post_id):
+    post = await get_async_database()['posts'].find_one({'_id': ObjectId(post_id)}, {'likes': 1})
+    return post.get('likes', 0) if post else 0
@@ -0,0 +1,33 @@
+# Synthetic datasets for the benchmarks, generated with seed.py. The same size always produces the same dataset, and a database which
+# already holds it is reused.
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import seed as seeding
+
+# Bumped whenever the generated documents change, so that older seeded databases are seeded again
+DATASET_VERSION = 2
+
+# Seeds the database with `posts` posts (and one user per 100 posts). The first user also saves `saves` posts, so their gallery has pages.
+# Returns the id of the first user.
+def seed(database, posts, saves=500, batch_size=1000):
+    marker = database.benchmark_meta.find_one({'_id': 'dataset'})
+    if marker and marker.get('posts') == posts and marker.get('version') == DATASET_VERSION:
+        return marker['user_id']
+
+    for name in ('users', 'posts', 'likes', 'saves', 'benchmark_meta'):
+        database.drop_collection(name)
+
+    seeding.generate(database, max(10, posts // 100), posts, likes=2, saves=0.5, batch_size=batch_size, seed=posts)
+
+    user_id = str(seeding.user_id(0))
+    now = datetime.datetime.utcnow()
+    saved = [seeding.post_id(position) for position in range(min(saves, posts))]
+    database.saves.delete_many({'user_id': user_id})
+    seeding.insert_batches(database.saves, ({'user_id': user_id, 'post_id': post_id, 'created_at': now - datetime.timedelta(seconds=i)}
+                                            for i, post_id in enumerate(saved)), batch_size)
+
+    database.benchmark_meta.insert_one({'_id': 'dataset', 'posts': posts, 'version': DATASET_VERSION, 'user_id': user_id})
+    return user_id
@@ -0,0 +1,109 @@
+# Load test of the like endpoint's rate limits and request coalescing (see ratelimit.py and explore.js).
+#
+# Bursts of likes are sent through the app with Flask's test client while the MongoDB writes they cause are counted:
+# - "toggle":   one user mashes the like button and every click is sent as a toggle (how the endpoint was used before)
+# - "desired":  the same burst, but every request asks for the final state (?liked=true), as explore.js sends after its debounce
+# - "shared ip": many users behind one address, each clicking a few times
+# Every row shows how many requests were let through, how many were answered with 429, and how many writes reached the database.
+#
+#   python benchmarks/interaction_burst.py [--clicks 200] [--users 50]
+#
+# Uses the database from MONGO_URI / MONGO_DBNAME, the post it creates (and its likes) are removed afterwards.
+import argparse
+import datetime
+import os
+import sys
+import time
+
+from bson.objectid import ObjectId
+from pymongo import monitoring
+
+# Sessions are kept in signed cookies, so the benchmark's logins don't leave session files in ./flask_session
+os.environ.setdefault('SESSION_BACKEND', 'cookie')
+os.environ.setdefault('APP_SECRET_KEY', 'benchmark')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import db
+
+# Counts the write commands sent to MongoDB
+class WriteCounter(monitoring.CommandListener):
+    WRITES = ('insert', 'update', 'delete', 'findAndModify')
+
+    def __init__(self):
+        self.writes = 0
+
+    def started(self, event):
+        if event.command_name in self.WRITES:
+            self.writes += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+writes = WriteCounter()
+# Listeners have to be registered before the client is created
+db.event_listeners.append(writes)
+
+import ratelimit
+from app import create_app
+from indexes import ensure_indexes
+
+def reset_limits():
+    ratelimit.user_limiter.buckets.clear()
+    ratelimit.ip_limiter.buckets.clear()
+    ratelimit.post_limiter.buckets.clear()
+
+# Sends the requests, returns (allowed, limited, writes, milliseconds)
+def burst(requests):
+    reset_limits()
+    before = writes.writes
+    allowed = limited = 0
+    start = time.perf_counter()
+    for client, path in requests:
+        status = client.post(path).status_code
+        if status == 429:
+            limited += 1
+        else:
+            allowed += 1
+    return allowed, limited, writes.writes - before, (time.perf_counter() - start) * 1000
+
+def logged_in_client(app, user_id, ip):
+    client = app.test_client()
+    client.environ_base['REMOTE_ADDR'] = ip
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    return client
+
+def main():
+    parser = argparse.ArgumentParser(description='Sends bursts of likes and counts how many are rate limited and how many reach the database.')
+    parser.add_argument('--clicks', type=int, default=200)
+    parser.add_argument('--users', type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_app()
+    database = db.get_database()
+    ensure_indexes(database)
+
+    user_ids = [f"benchmark-user-{i}" for i in range(args.users)]
+    post_id = str(database.posts.insert_one({'user_id': user_ids[0], 'username': 'benchmark', 'post_title': 'Benchmark',
+                                             'likes': 0, 'saves': 0, 'created_at': datetime.datetime.utcnow()}).inserted_id)
+    try:
+        client = logged_in_client(app, user_ids[0], '10.0.0.1')
+        rows = [
+            ('toggle', burst([(client, f"/like_post/{post_id}")] * args.clicks)),
+            ('desired', burst([(client, f"/like_post/{post_id}?liked=true")] * args.clicks)),
+            ('shared ip', burst([(logged_in_client(app, user_id, '10.0.0.2'), f"/like_post/{post_id}?liked=true") for user_id in user_ids
+                                 for _ in range(max(1, args.clicks // args.users))])),
+        ]
+
+        print(f"{'burst':<12}{'allowed':>10}{'429':>8}{'writes':>10}{'ms':>10}")
+        for name, (allowed, limited, write_count, ms) in rows:
+            print(f"{name:<12}{allowed:>10}{limited:>8}{write_count:>10}{ms:>10.1f}")
+    finally:
+        database.likes.delete_many({'post_id': ObjectId(post_id)})
+        database.posts.delete_one({'_id': ObjectId(post_id)})
+
+if __name__ == '__main__':
+    main()
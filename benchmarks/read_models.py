@@ -0,0 +1,67 @@
+# Memory and bytes read per page of post cards, before (whole post documents) and after (projected fields decoded into PostCards, see
+# models.py). The posts are seeded the way older versions stored them, with every like in their users_that_like_post array, so the
+# difference grows with how popular the posts are.
+#
+#   python benchmarks/read_models.py [--posts 1000] [--likes 2000] [--pages 20] [--mongomock]
+#
+# MongoDB is the server at MONGO_URI (its database artroam_benchmark_read_models is dropped and seeded again) or mongomock with --mongomock.
+import argparse
+import os
+import sys
+import tracemalloc
+
+import bson
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import db
+
+# Reads `pages` pages of the explore feed with read_page and returns the peak memory (bytes) of holding one page, and the BSON size of
+# the documents Mongo sent back for it
+def measure(database, read_page, pages):
+    from utils import PAGE_SIZE
+    peaks, sizes = [], []
+    for page in range(pages):
+        tracemalloc.start()
+        posts, sent = read_page(database.posts, page * PAGE_SIZE, PAGE_SIZE)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        sizes.append(sent)
+        del posts
+    return sum(peaks) / len(peaks), sum(sizes) / len(sizes)
+
+def whole_documents(collection, skip, limit):
+    posts = list(collection.find({}, skip=skip, limit=limit))
+    return posts, sum(len(bson.encode(post)) for post in posts)
+
+def post_cards(collection, skip, limit):
+    from models import CARD_PROJECTION, post_cards
+    documents = list(collection.find({}, CARD_PROJECTION, skip=skip, limit=limit))
+    return post_cards(documents), sum(len(bson.encode(document)) for document in documents)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the memory and bytes read per page of post cards, whole documents vs read models.')
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--likes', type=float, default=2000, help='average number of likes per post')
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--mongomock', action='store_true', help='use mongomock instead of the MongoDB server at MONGO_URI')
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+        db.create_mongo_client = lambda: client
+
+    import seed
+    database = db.get_client()['artroam_benchmark_read_models']
+    for name in ('users', 'posts', 'likes', 'saves'):
+        database.drop_collection(name)
+    seed.generate(database, max(int(args.likes * 2), 10), args.posts, likes=args.likes, saves=0, legacy=True)
+
+    print(f"{args.posts} posts with {args.likes:g} likes on average, {args.pages} pages")
+    print(f"{'':<18}{'memory KiB':>12}{'read KiB':>12}")
+    for name, read_page in (('whole documents', whole_documents), ('post cards', post_cards)):
+        memory, sent = measure(database, read_page, args.pages)
+        print(f"{name:<18}{memory / 1024:>12.1f}{sent / 1024:>12.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+# Benchmark of the hot routes: the explore feed, search, filters, the gallery, liking and creating a post.
+#
+# Every route is called through Flask's test client against a seeded synthetic dataset (see dataset.py) of each requested size, and the
+# latency (p50 / p99), throughput and MongoDB round trips per request are measured. The results are saved as JSON in
+# benchmarks/results/ and compared with the previous run, so regressions show up between runs.
+#
+#   python benchmarks/routes.py [--sizes 1000,100000,1000000] [--requests 200] [--threads 1] [--mongomock] [--compare results/<file>.json]
+#
+# It runs offline: MongoDB is the server at MONGO_URI (a local mongod, e.g. mongodb://localhost:27017) or mongomock with --mongomock,
+# and S3 is moto's in-process stand-in (or the server at S3_ENDPOINT_URL, e.g. `moto_server`). Each size is seeded once into its own
+# database, artroam_benchmark_<size>, and reused by later runs.
+# mongomock is only good for small sizes: it doesn't report round trips, and the routes it can't run (see MONGOMOCK_UNSUPPORTED) are skipped.
+import argparse
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# The benchmark runs as one user hammering the app, so the rate limits are lifted, and sessions are kept in the cookie
+os.environ.setdefault('INTERACTION_RATE', '1000000')
+os.environ.setdefault('INTERACTION_BURST', '1000000')
+os.environ.setdefault('INTERACTION_IP_RATE', '1000000')
+os.environ.setdefault('INTERACTION_IP_BURST', '1000000')
+os.environ.setdefault('INTERACTION_POST_RATE', '1000000')
+os.environ.setdefault('INTERACTION_POST_BURST', '1000000')
+os.environ.setdefault('SESSION_BACKEND', 'cookie')
+os.environ.setdefault('APP_SECRET_KEY', 'benchmark')
+os.environ.setdefault('BUCKET_NAME', 'artroam-benchmark')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import db
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# Routes which use MongoDB features mongomock doesn't have
+MONGOMOCK_UNSUPPORTED = {'search': '$text search', 'like_post': 'the update pipeline of counter_update()'}
+
+# The app answers unexpected errors with its error page and a 200 status (see handle_error in app.py), so a request counts as failed
+# when its status is an error or the error page was rendered while answering it. Requests are answered on the thread which sent them.
+error_pages = set()
+
+def record_error_page(sender, template, context, **extra):
+    if template.name == 'error.html':
+        error_pages.add(threading.get_ident())
+
+def failed(status):
+    if threading.get_ident() in error_pages:
+        error_pages.discard(threading.get_ident())
+        return True
+    return status >= 400
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+# Placeholder image uploaded by the create benchmark
+def placeholder_image():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (1200, 900), (200, 120, 80)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+class RouteBenchmark:
+    def __init__(self, app, user_id, post_ids):
+        self.app = app
+        self.user_id = user_id
+        self.post_ids = post_ids
+        self.image = placeholder_image()
+        self.calls = 0
+
+    def client(self):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = self.user_id
+            session['username'] = 'benchmark'
+        return client
+
+    def next_index(self):
+        self.calls += 1
+        return self.calls
+
+    # Each route is a function which sends one request (or the requests of one user action) and returns the final response.
+    # The second element is the route label used by metrics.py, to read the round trips of the route.
+    def routes(self):
+        from seed import WORDS
+        import storage
+
+        first_page = self.client().get('/feed').get_json()
+
+        def create(client):
+            # The browser asks for an upload URL, uploads the image straight to the bucket (not part of the app's time) and submits the post
+            key = client.post('/upload_url', json={'content_type': 'image/jpeg'}).get_json()['key']
+            started_at = time.perf_counter()
+            storage.put_object(key, self.image, 'image/jpeg')
+            upload_time = time.perf_counter() - started_at
+            client.post('/create', json={'key': key})
+            client.get('/post')
+            return client.post('/post_data', data={'post_title': 'Benchmark post', 'post_description': 'benchmark',
+                                                   'image_type': 'photography'}), upload_time
+
+        return {
+            'home': ('/', lambda client: client.get('/')),
+            'home (trending)': ('/', lambda client: client.get('/?sort=trending')),
+            'feed next page': ('/feed', lambda client: client.get('/feed', query_string={'cursor': first_page['next_cursor']})),
+            'search': ('/search', lambda client: client.get('/search', query_string={'search': WORDS[self.next_index() % len(WORDS)]})),
+            'filter': ('/filter/<tag>', lambda client: client.get('/filter/photography')),
+            'gallery': ('/gallery', lambda client: client.get('/gallery')),
+            'like_post': ('/like_post/<post_id>', lambda client: client.post(
+                f"/like_post/{self.post_ids[self.next_index() % len(self.post_ids)]}?liked={'true' if self.calls % 2 else 'false'}")),
+            'create': ('/post_data', create),
+        }
+
+# Mean number of MongoDB commands per request of a route, from the histogram kept by metrics.py
+def round_trip_totals(route):
+    import metrics
+    with metrics.request_round_trips.lock:
+        series = metrics.request_round_trips.series.get((route,))
+        return (series[1], series[2]) if series else (0, 0)
+
+def measure(benchmark, route, send, requests, threads):
+    clients = [benchmark.client() for _ in range(threads)]
+    send(clients[0])  # warm up
+    error_pages.discard(threading.get_ident())
+
+    count_before, commands_before = round_trip_totals(route)
+    latencies = []
+    errors = []
+
+    def run(client, n):
+        for _ in range(n):
+            started_at = time.perf_counter()
+            response = send(client)
+            excluded = 0
+            if isinstance(response, tuple):
+                response, excluded = response
+            latencies.append(time.perf_counter() - started_at - excluded)
+            errors.append(failed(response.status_code))
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for i, client in enumerate(clients):
+            executor.submit(run, client, requests // threads + (1 if i < requests % threads else 0))
+    elapsed = time.perf_counter() - started_at
+
+    count_after, commands_after = round_trip_totals(route)
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'round_trips': round((commands_after - commands_before) / (count_after - count_before), 2) if count_after > count_before else None,
+    }
+
+def run_size(size, args):
+    import dataset
+    from app import create_app
+    from flask import template_rendered
+    from cache import cache
+    from indexes import ensure_indexes
+
+    os.environ['MONGO_DBNAME'] = f"artroam_benchmark_{size}"
+    database = db.get_database()
+    started_at = time.perf_counter()
+    user_id = dataset.seed(database, size)
+    ensure_indexes(database)
+    print(f"\n{size} posts (seeded in {time.perf_counter() - started_at:.1f} s)")
+
+    # Nothing is served from the cache of the previous size
+    cache.local.entries.clear()
+    cache.bump_version('feed')
+
+    post_ids = [str(post['_id']) for post in database.posts.find({}, {'_id': 1}).limit(1000)]
+    app = create_app()
+    template_rendered.connect(record_error_page, app, weak=False)
+    benchmark = RouteBenchmark(app, user_id, post_ids)
+
+    results = {}
+    print(f"{'route':<18}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}{'mongo':>8}{'errors':>8}")
+    for name, (route, send) in benchmark.routes().items():
+        if args.mongomock and name in MONGOMOCK_UNSUPPORTED:
+            print(f"{name:<18}skipped, mongomock doesn't support {MONGOMOCK_UNSUPPORTED[name]}")
+            continue
+        result = results[name] = measure(benchmark, route, send, args.requests, args.threads)
+        if args.mongomock:
+            # mongomock doesn't report the commands it serves
+            result['round_trips'] = None
+        round_trips = '-' if result['round_trips'] is None else result['round_trips']
+        print(f"{name:<18}{result['p50_ms']:>10}{result['p99_ms']:>10}{result['throughput_rps']:>10}{round_trips:>8}{result['errors']:>8}")
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__), text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def latest_results():
+    files = sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json')))
+    return files[-1] if files else None
+
+# Prints how p50 / p99 changed since a previous run, for the sizes and routes both runs measured
+def compare(previous_file, results):
+    with open(previous_file) as f:
+        previous = json.load(f)
+    print(f"\nCompared with {os.path.basename(previous_file)} (commit {previous['meta'].get('commit')}):")
+    print(f"{'size':>9}  {'route':<18}{'p50':>10}{'p99':>10}")
+    for size, routes in results.items():
+        for name, result in routes.items():
+            before = previous['results'].get(size, {}).get(name)
+            if not before:
+                continue
+            changes = [f"{(result[key] - before[key]) / before[key] * 100:+.0f}%" if before[key] else '-' for key in ('p50_ms', 'p99_ms')]
+            print(f"{size:>9}  {name:<18}{changes[0]:>10}{changes[1]:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the latency, throughput and MongoDB round trips of the hot routes.')
+    parser.add_argument('--sizes', default='1000', help='comma separated numbers of posts, e.g. 1000,100000,1000000')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route and size')
+    parser.add_argument('--threads', type=int, default=1, help='clients sending requests at the same time')
+    parser.add_argument('--mongomock', action='store_true', help='use mongomock instead of the MongoDB server at MONGO_URI')
+    parser.add_argument('--compare', help='results file to compare with (default: the latest one in benchmarks/results)')
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+        db.create_mongo_client = lambda: client
+
+    # S3 is moto's in-process stand-in, unless S3_ENDPOINT_URL points at one
+    if not os.getenv('S3_ENDPOINT_URL'):
+        from moto import mock_aws
+        mock_aws().start()
+    try:
+        db.get_s3().create_bucket(Bucket=os.getenv('BUCKET_NAME'))
+    except db.get_s3().exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    previous_file = args.compare or latest_results()
+    results = {size: run_size(int(size), args) for size in args.sizes.split(',')}
+
+    # The images of the posts created by the benchmark are still being processed in the background
+    import jobs
+    jobs.executor.shutdown(wait=True)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    started_at = datetime.datetime.utcnow()
+    output = os.path.join(RESULTS_DIR, f"{started_at:%Y%m%d-%H%M%S}.json")
+    with open(output, 'w') as f:
+        json.dump({'meta': {'date': started_at.isoformat(), 'commit': git_commit(), 'python': platform.python_version(),
+                            'mongo': 'mongomock' if args.mongomock else 'mongod', 'requests': args.requests, 'threads': args.threads},
+                   'results': results}, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if previous_file:
+        compare(previous_file, results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Compares the per-request overhead of the session backends in sessions.py.
+#
+# Each backend serves two tiny routes through Flask's test client: one which only reads the session (most requests in the app)
+# and one which changes it (e.g. logging in). The "none" row is the same app without touching the session at all.
+#
+#   python benchmarks/session_backends.py [--requests 2000]
+#
+# The mongodb backend uses the database from MONGO_URI / MONGO_DBNAME (a `benchmark_sessions` collection which is dropped afterwards).
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from flask import Flask, session
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from db import get_client
+from sessions import SESSION_BACKENDS, init_session
+
+def make_app(backend, database):
+    app = Flask(__name__)
+    app.secret_key = 'benchmark'
+    app.config['SESSION_FILE_DIR'] = tempfile.mkdtemp()
+
+    if backend != 'none':
+        init_session(app, database, backend)
+        if backend == 'mongodb':
+            app.session_interface.collection_name = 'benchmark_sessions'
+
+    @app.route('/none')
+    def no_session():
+        return 'ok'
+
+    @app.route('/read')
+    def read_session():
+        return session.get('user_id', '')
+
+    @app.route('/write')
+    def write_session():
+        session['counter'] = session.get('counter', 0) + 1
+        return 'ok'
+
+    return app
+
+# Returns the mean time per request (in microseconds)
+def measure(client, path, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(path)
+    return (time.perf_counter() - start) / requests * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the per-request overhead of the session backends.')
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    database = get_client()[os.getenv('MONGO_DBNAME', 'artroam')]
+
+    print(f"{'backend':<12}{'read (us)':>12}{'write (us)':>12}")
+    for backend in ('none',) + SESSION_BACKENDS:
+        client = make_app(backend, database).test_client()
+        if backend == 'none':
+            read = write = measure(client, '/none', args.requests)
+        else:
+            # Log in once so that the read requests have a session to load
+            client.get('/write')
+            read = measure(client, '/read', args.requests)
+            write = measure(client, '/write', args.requests)
+        print(f"{backend:<12}{read:>12.1f}{write:>12.1f}")
+
+    database.drop_collection('benchmark_sessions')
+
+if __name__ == '__main__':
+    main()
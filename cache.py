@@ -0,0 +1,216 @@
+from collections import OrderedDict
+import os
+import pickle
+import threading
+import time
+
+# Optional shared cache tier. It is only used when the redis package is installed and CACHE_REDIS_URL is set.
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# How long (in seconds) each kind of entry is kept
+FEED_TTL = 30
+USER_TTL = 300
+LIKES_TTL = 300
+
+# In-process cache tier: a least recently used cache whose entries also expire after their time to live
+class LRUCache:
+    def __init__(self, max_size=2048):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    # An entry set with ttl=None never expires (it can still be evicted)
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl if ttl is not None else float('inf'))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            value, _ = self.entries.get(key, (0, None))
+            # Counters never expire
+            self.entries[key] = (value + 1, float('inf'))
+            return value + 1
+
+    # The value of a counter kept with incr()
+    def counter(self, key):
+        return self.get(key) or 0
+
+    def __len__(self):
+        return len(self.entries)
+
+# Shared cache tier, so that every app process sees the same entries and invalidations.
+# Values are pickled, counters are plain Redis integers (INCR) and are read with counter() instead of get().
+class RedisCache:
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        value = self.client.get(key)
+        return pickle.loads(value) if value is not None else None
+
+    # Returns the values of several keys (None for the missing ones) in one round trip
+    def get_many(self, keys):
+        return [pickle.loads(value) if value is not None else None for value in self.client.mget(keys)]
+
+    def set(self, key, value, ttl):
+        self.client.set(key, pickle.dumps(value), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+    def counter(self, key):
+        return int(self.client.get(key) or 0)
+
+# Read-through cache used by the routes. Lookups try the in-process tier first, then the shared tier (if configured).
+# Hits and misses are counted per kind of entry (the part of the key before the first ":").
+class Cache:
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+        self.hits = {}
+        self.misses = {}
+
+    def count(self, counters, key):
+        kind = key.split(':', 1)[0]
+        counters[kind] = counters.get(kind, 0) + 1
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                # The shared tier doesn't tell us how long the entry has left, so it is kept locally for the shortest time to live
+                self.local.set(key, value, FEED_TTL)
+
+        self.count(self.hits if value is not None else self.misses, key)
+        return value
+
+    # Like get() for several keys, with a single round trip to the shared tier for the keys which aren't in the local one
+    def get_many(self, keys):
+        values = {key: self.local.get(key) for key in keys}
+        missing = [key for key, value in values.items() if value is None]
+        if missing and self.shared is not None:
+            for key, value in zip(missing, self.shared.get_many(missing)):
+                if value is not None:
+                    values[key] = value
+                    self.local.set(key, value, FEED_TTL)
+
+        for key, value in values.items():
+            self.count(self.hits if value is not None else self.misses, key)
+        return values
+
+    def set(self, key, value, ttl):
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            self.shared.set(key, value, ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    # Returns the cached value, or calls load() and caches its result
+    def get_or_load(self, key, load, ttl):
+        value = self.get(key)
+        if value is None:
+            value = load()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
+
+    # Version numbers are part of the keys of entries which can't be invalidated one by one (e.g. feed pages):
+    # bumping the version makes every old entry unreachable, they then fall out of the cache.
+    # Versions are not counted as hits or misses.
+    def version(self, name):
+        tier = self.shared if self.shared is not None else self.local
+        return tier.counter(f"version:{name}")
+
+    # With timed=True the time of the bump is kept too, it is the Last-Modified time of the responses built from that version (see httpcache.py)
+    def bump_version(self, name, timed=True):
+        tier = self.shared if self.shared is not None else self.local
+        if timed:
+            tier.set(f"modified:{name}", time.time(), None)
+        return tier.incr(f"version:{name}")
+
+    # The time (seconds since the epoch) the version was last bumped, or None
+    def modified(self, name):
+        tier = self.shared if self.shared is not None else self.local
+        return tier.get(f"modified:{name}")
+
+    def stats(self):
+        return {
+            'hits': dict(self.hits),
+            'misses': dict(self.misses),
+            'local_entries': len(self.local),
+            'shared': self.shared is not None
+        }
+
+cache = Cache(LRUCache(int(os.getenv('CACHE_SIZE', 2048))),
+              RedisCache(redis.Redis.from_url(os.getenv('CACHE_REDIS_URL'))) if redis is not None and os.getenv('CACHE_REDIS_URL') else None)
+
+# Keys and invalidation of each kind of cached data
+def user_key(user_id):
+    return f"user:{user_id}"
+
+def likes_key(post_id):
+    return f"likes:{post_id}"
+
+def feed_key(search, tag, cursor, sort=None):
+    return f"feed:{cache.version('feed')}:{search or ''}:{tag or ''}:{sort or ''}:{cursor or ''}"
+
+# The version of the user's own likes and saves (the state of the buttons on their pages)
+def interactions_version(user_id):
+    return f"interactions:{user_id}"
+
+def invalidate_user(user_id):
+    cache.delete(user_key(user_id))
+
+# Called whenever a post is added or removed, or the author details shown on posts change
+def invalidate_feeds():
+    cache.bump_version('feed')
+
+# Called by the like and save engine whenever a user likes, unlikes, saves or unsaves a post: the like counts (and trending order) of the
+# pages changed, and so did the user's own buttons. Like counts change too often to throw the cached pages away (see set_like_count),
+# these versions only decide whether a browser's copy of a page is still current.
+def record_interaction(user_id):
+    cache.bump_version('counts')
+    cache.bump_version(interactions_version(user_id), timed=False)
+
+# The feed pages keep the like count a post had when the page was cached, liking a post stores its new count
+# which is then shown instead (so a like doesn't throw away every cached page). With the shared tier the counts stored by every
+# process are seen, read for the whole page at once.
+def set_like_count(post_id, likes):
+    cache.set(likes_key(post_id), likes, LIKES_TTL)
+
+def apply_like_counts(posts):
+    counts = cache.get_many([likes_key(post['_id']) for post in posts])
+    for post in posts:
+        likes = counts[likes_key(post['_id'])]
+        if likes is not None:
+            post['likes'] = likes
+    return posts
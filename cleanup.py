@@ -0,0 +1,54 @@
+from images import post_image_keys
+from storage import delete_later, key_from_url, is_bucket_url
+from utils import database, counter_update
+from cache import invalidate_feeds
+
+# Deleted posts and accounts are cleaned up in batches of this many documents
+BATCH_SIZE = 1000
+
+def chunks(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+# Deletes the likes and saves of deleted posts (the galleries also drop saves of deleted posts when they come across them)
+def remove_post_references(post_ids):
+    for chunk in chunks(list(post_ids)):
+        database['saves'].delete_many({'post_id': {'$in': chunk}})
+        database['likes'].delete_many({'post_id': {'$in': chunk}})
+
+# Removes the likes (or saves) of a user, taking them off the counters of the posts, one batch at a time
+def delete_user_interactions(collection, counter, user_id):
+    while True:
+        interactions = list(database[collection].find({'user_id': user_id}, {'post_id': 1}).limit(BATCH_SIZE))
+        if not interactions:
+            return
+
+        database['posts'].update_many({'_id': {'$in': [interaction['post_id'] for interaction in interactions]}}, counter_update(counter, -1))
+        database[collection].delete_many({'_id': {'$in': [interaction['_id'] for interaction in interactions]}})
+
+# Deletes the posts (and their images) of a user, one batch at a time so a prolific user doesn't have to fit in memory
+def delete_user_posts(user_id):
+    while True:
+        posts = list(database['posts'].find({'user_id': user_id}, {'image_url': 1, 'renditions': 1}).limit(BATCH_SIZE))
+        if not posts:
+            return
+
+        post_ids = [post['_id'] for post in posts]
+        for post in posts:
+            delete_later(*post_image_keys(post))
+        remove_post_references(post_ids)
+        database['posts'].delete_many({'_id': {'$in': post_ids}})
+
+# Background job run once an account is deleted: removes everything the user left behind so that no feed query has to skip over it.
+# That is their avatar, their posts with their images (and the likes and saves of those posts) and their likes and saves of other users' posts.
+def delete_user_content(user_id, avatar_url=None):
+    user_id = str(user_id)
+
+    if avatar_url and is_bucket_url(avatar_url):
+        delete_later(key_from_url(avatar_url))
+
+    delete_user_posts(user_id)
+
+    delete_user_interactions('likes', 'likes', user_id)
+    delete_user_interactions('saves', 'saves', user_id)
+    invalidate_feeds()
@@ -0,0 +1,89 @@
+from botocore.config import Config
+from pymongo import MongoClient
+import boto3
+import os
+import threading
+
+# Shared data access for the whole app: the MongoDB client and the AWS S3 client are created the first time they are used, once per
+# process. Nothing connects at import time, and each worker of a pre-forking server (e.g. gunicorn) creates its own clients after the
+# fork instead of inheriting the parent's sockets, which are not safe to share between processes.
+#
+# Settings (environment variables):
+# MONGO_MAX_POOL_SIZE / MONGO_MIN_POOL_SIZE    connections kept per process (default 20 / 0)
+# MONGO_CONNECT_TIMEOUT_MS                     default 5000
+# MONGO_SERVER_SELECTION_TIMEOUT_MS            how long a query waits for a reachable server, default 5000
+# MONGO_SOCKET_TIMEOUT_MS                      default 30000
+# MONGO_READ_PREFERENCE                        e.g. primaryPreferred or secondaryPreferred, default primary
+# S3_MAX_POOL_CONNECTIONS                      connections kept per process, default 20
+
+# pymongo command listeners and boto3 (event name, handler) hooks (see metrics.py), they must be registered before the clients are created
+event_listeners = []
+s3_event_hooks = []
+
+lock = threading.Lock()
+clients = {}
+
+# Returns the client stored under name for this process, creating it with create() the first time
+def process_client(name, create):
+    pid = os.getpid()
+    client = clients.get(name)
+    if client is None or client[0] != pid:
+        with lock:
+            client = clients.get(name)
+            if client is None or client[0] != pid:
+                client = (pid, create())
+                clients[name] = client
+    return client[1]
+
+# Client options shared by the sync and the async MongoDB clients
+def mongo_options():
+    return dict(maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', 20)),
+                minPoolSize=int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+                connectTimeoutMS=int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+                serverSelectionTimeoutMS=int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+                socketTimeoutMS=int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 30000)),
+                readPreference=os.getenv('MONGO_READ_PREFERENCE', 'primary'),
+                event_listeners=list(event_listeners))
+
+def create_mongo_client():
+    # Connections are opened by the first query, not when the client is created
+    return MongoClient(os.getenv('MONGO_URI'), connect=False, **mongo_options())
+
+# The async (Motor) client used by the endpoints of the ASGI app (asgi.py). Motor is only needed when serving asgi.py.
+def create_async_mongo_client():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    return AsyncIOMotorClient(os.getenv('MONGO_URI'), **mongo_options())
+
+def create_s3_client():
+    client = boto3.client('s3', region_name=os.getenv('AWS_REGION', 'us-east-1'),
+                        endpoint_url=os.getenv('S3_ENDPOINT_URL'),
+                        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                        config=Config(max_pool_connections=int(os.getenv('S3_MAX_POOL_CONNECTIONS', 20)),
+                                      retries={'max_attempts': 3, 'mode': 'standard'}))
+    for event_name, handler in s3_event_hooks:
+        client.meta.events.register(event_name, handler)
+    return client
+
+def get_client():
+    return process_client('mongo', create_mongo_client)
+
+def get_database():
+    return get_client()[os.getenv('MONGO_DBNAME')]
+
+def get_async_database():
+    return process_client('motor', create_async_mongo_client)[os.getenv('MONGO_DBNAME')]
+
+def get_s3():
+    return process_client('s3', create_s3_client)
+
+# Stands in for the database object so modules can keep using `database.posts` / `database['posts']`.
+# Every access goes to the current process's client.
+class LazyDatabase:
+    def __getattr__(self, name):
+        return getattr(get_database(), name)
+
+    def __getitem__(self, name):
+        return get_database()[name]
+
+database = LazyDatabase()
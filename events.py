@@ -0,0 +1,135 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+# Live like counts for the explore page. Browsers open a Server-Sent Events stream (/events/likes?ids=...) for the posts on their screen,
+# and every time the like engine changes the like count of one of those posts, the new count is pushed to them. Nothing is polled and
+# pushing a count doesn't read the database.
+#
+# Counts are published by the like engine of the process which handled the like (utils.py / async_utils.py). With more than one
+# app process, set LIKE_EVENTS_CHANGE_STREAM=1 (needs a replica set, e.g. MongoDB Atlas) so every process also follows the like
+# counts written by the others through a MongoDB change stream.
+
+# Seconds between keep-alive comments, so proxies don't close idle streams
+KEEPALIVE_INTERVAL = 15
+
+# At most this many posts per stream, the same as /post_states
+MAX_SUBSCRIBED_POSTS = 100
+
+# A stream with its set of posts, served on an event loop (the ASGI app). Counts published while the stream is busy sending are merged,
+# so a post liked many times in a row is sent once with its latest count. Counts are published from other threads, so the loop is
+# woken safely.
+class AsyncSubscription:
+    def __init__(self, post_ids):
+        self.post_ids = set(post_ids)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def notify(self, post_id, likes):
+        with self.lock:
+            self.pending[post_id] = likes
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    # Returns the counts published since the last call
+    def take(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.event.clear()
+        return self.take()
+
+# Fans the published counts out to the subscriptions of each post
+class LikeBroker:
+    def __init__(self):
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, subscription):
+        with self.lock:
+            for post_id in subscription.post_ids:
+                self.subscriptions.setdefault(post_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for post_id in subscription.post_ids:
+                subscribers = self.subscriptions.get(post_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscriptions[post_id]
+
+    def publish(self, post_id, likes):
+        with self.lock:
+            subscribers = list(self.subscriptions.get(post_id, ()))
+        for subscription in subscribers:
+            subscription.notify(post_id, likes)
+
+    def stats(self):
+        with self.lock:
+            return {'posts': len(self.subscriptions), 'subscriptions': len(set().union(*self.subscriptions.values()))}
+
+broker = LikeBroker()
+
+# Called by the like engine with the new like count of a post
+def publish_like_count(post_id, likes):
+    broker.publish(str(post_id), likes)
+
+# The post ids of a /events/likes request, e.g. ?ids=<id>,<id>
+def subscribed_post_ids(ids):
+    return [post_id for post_id in (ids or '').split(',') if post_id][:MAX_SUBSCRIBED_POSTS]
+
+# Server-Sent Events messages: a "likes" event whose data maps post ids to their like counts, and a keep-alive comment.
+# `retry` tells the browser how long to wait before reconnecting when the stream ends.
+def likes_message(counts):
+    return f"event: likes\ndata: {json.dumps(counts)}\n\n"
+
+STREAM_START = "retry: 3000\n\n"
+KEEPALIVE = ": keepalive\n\n"
+
+# The stream served by the ASGI app (asgi.py), open until the browser goes away. The Flask app doesn't serve it: every open stream would
+# hold one of its worker threads.
+async def async_like_count_stream(post_ids):
+    subscription = broker.subscribe(AsyncSubscription(post_ids))
+    try:
+        yield STREAM_START
+        while True:
+            counts = await subscription.wait(KEEPALIVE_INTERVAL)
+            yield likes_message(counts) if counts else KEEPALIVE
+    finally:
+        broker.unsubscribe(subscription)
+
+# Follows the like counts written by every app process with a MongoDB change stream and publishes them to this process's streams.
+# Runs on its own thread for the life of the process, reconnecting (and resuming where it stopped) when the stream fails.
+def follow_like_counts(database):
+    pipeline = [{'$match': {'operationType': 'update', 'updateDescription.updatedFields.likes': {'$exists': True}}}]
+    resume_token = None
+    delay = 1
+    while True:
+        try:
+            with database.posts.watch(pipeline, resume_after=resume_token) as stream:
+                delay = 1
+                for change in stream:
+                    resume_token = stream.resume_token
+                    publish_like_count(change['documentKey']['_id'], change['updateDescription']['updatedFields']['likes'])
+        except Exception as err:
+            print('* Like count change stream failed, reconnecting:', err)
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+def start_change_stream(database):
+    if os.getenv('LIKE_EVENTS_CHANGE_STREAM') != '1':
+        return None
+    thread = threading.Thread(target=follow_like_counts, args=(database,), name='artroam-like-events', daemon=True)
+    thread.start()
+    return thread
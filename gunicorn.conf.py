@@ -0,0 +1,40 @@
+import multiprocessing
+import os
+
+# Production server settings: `gunicorn -c gunicorn.conf.py "app:create_app()"`
+# Every setting can be overridden with the environment variable next to it.
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', 8000)}")
+
+# Worker processes (WEB_CONCURRENCY), each serving requests from a pool of threads (GUNICORN_THREADS). Most of a request is spent
+# waiting on MongoDB or S3, so threads let one process keep several requests in flight. Keep workers * threads within the MongoDB
+# connection pool (MONGO_MAX_POOL_SIZE is per process).
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker serves the ASGI app (asgi.py) instead, where threads don't apply
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Idle keep-alive connections are held for this many seconds, set it above the load balancer's idle timeout when there is one
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# A request taking longer than timeout gets its worker restarted; on shutdown or reload workers get graceful_timeout seconds to
+# finish the requests they are serving
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# Workers are replaced after this many requests (plus a random jitter, so they don't all restart at once)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Loading the app before forking shares its memory between workers. The MongoDB and S3 clients (db.py) and the background job
+# pool (jobs.py) are created again in each worker, so this is safe either way.
+preload_app = os.getenv('GUNICORN_PRELOAD', '0') == '1'
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+# With preload_app the app was created in the master process, so each worker starts its own startup tasks
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        import app
+        app.start_background_tasks()
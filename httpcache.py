@@ -0,0 +1,76 @@
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag, unquote_etag
+import datetime
+import functools
+import hashlib
+import time
+
+from cache import cache, FEED_TTL, interactions_version
+
+# HTTP conditional requests for the feed pages and the small JSON endpoints. Every response carries an ETag (and, when it is the same for
+# every visitor, a Last-Modified time) made from the cache versions its data depends on (see cache.py):
+# - "feed": bumped when a post is added or removed, or the author details shown on posts change
+# - "counts": bumped on every like, unlike, save and unsave (the like counts and trending order)
+# - the user's own interactions version: the state of their like and save buttons
+# A browser asking again with If-None-Match / If-Modified-Since gets a 304 as long as none of those versions changed, without the route
+# running its queries or rendering its template.
+#
+# Pages can be served from the cache for up to FEED_TTL seconds after the database changed (and without CACHE_REDIS_URL every process has
+# its own versions), so validators also roll over every FEED_TTL seconds: a browser is never told its copy is current for longer than that.
+
+# Returns the ETag and Last-Modified time (None for responses which depend on the session) of a response.
+# `key` tells responses of different URLs apart, user_id is the user in session (None for responses which are the same for everyone).
+def validators(key, names, user_id=None):
+    window = int(time.time() // FEED_TTL)
+    parts = [key, user_id or '', window]
+    modified = [window * FEED_TTL]
+    for name in names:
+        parts.append(cache.version(name))
+        modified.append(cache.modified(name) or 0)
+
+    etag = quote_etag(hashlib.sha1(repr(parts).encode()).hexdigest()[:24], weak=True)
+    # A user's own state isn't part of the time, so only the responses which are the same for every visitor get one
+    last_modified = None if user_id else datetime.datetime.fromtimestamp(max(modified), datetime.timezone.utc)
+    return etag, last_modified
+
+# Whether the browser's copy (from the request's If-None-Match / If-Modified-Since headers) is still current.
+# If-Modified-Since is only looked at when there is no If-None-Match, as HTTP asks.
+def not_modified(if_none_match, if_modified_since, etag, last_modified):
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(unquote_etag(etag)[0])
+    since = parse_date(if_modified_since) if if_modified_since else None
+    return since is not None and last_modified is not None and last_modified.replace(microsecond=0) <= since
+
+# Browsers (and shared caches, for responses which don't depend on the session) may keep the response but have to ask every time
+# whether it is still current. Responses which depend on the session are private and vary with the session cookie.
+def cache_headers(etag, last_modified, user_id=None, public=False):
+    headers = {'ETag': etag, 'Cache-Control': 'public, no-cache' if public or not user_id else 'private, no-cache'}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    if not public:
+        headers['Vary'] = 'Cookie'
+    return headers
+
+# The versions a response depends on, with the user's own interactions version if it shows their buttons
+def version_names(names, user_id=None, per_user=False):
+    return list(names) + ([interactions_version(user_id)] if per_user and user_id else [])
+
+# Decorator of the Flask routes. `names` are the versions the route's response depends on; per_user=True adds the version of the
+# user's own likes and saves, public=True marks a response which doesn't depend on the session at all.
+def conditional(*names, per_user=False, public=False):
+    def decorator(view):
+        @functools.wraps(view)
+        def conditional_view(*args, **kwargs):
+            from flask import make_response, request, session
+
+            user_id = None if public else session.get('user_id')
+            etag, last_modified = validators(request.full_path, version_names(names, user_id, per_user), user_id)
+            headers = cache_headers(etag, last_modified, user_id, public)
+            if not_modified(request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since'), etag, last_modified):
+                return '', 304, headers
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.headers.update(headers)
+            return response
+        return conditional_view
+    return decorator
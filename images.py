@@ -0,0 +1,72 @@
+from PIL import Image, ImageOps
+from tempfile import SpooledTemporaryFile
+import io
+
+from storage import public_url, key_from_url, download_stream, put_object
+from utils import database
+from cache import invalidate_feeds
+
+# The resized copies made of every posted image, by name and maximum width. Images are never scaled up.
+RENDITIONS = {'thumb': 320, 'feed': 720, 'full': 1600}
+
+WEBP_QUALITY = 80
+
+# Images are only decoded up to this many pixels (e.g. 8000 x 6000), whatever their size in bytes: a small, highly compressible file can
+# decode to hundreds of MB. Larger images keep just their original.
+MAX_IMAGE_PIXELS = 50_000_000
+
+# Renditions never change once made, so browsers and CDNs can keep them for a year
+RENDITION_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def rendition_key(key, name):
+    return f"{key.rsplit('.', 1)[0]}-{name}.webp"
+
+# Returns the keys of all of a post's images in the bucket (the original and its renditions)
+def post_image_keys(post):
+    keys = []
+    if post.get('image_url'):
+        keys.append(key_from_url(post['image_url']))
+    for rendition in (post.get('renditions') or {}).values():
+        keys.append(key_from_url(rendition['url']))
+    return keys
+
+# Resizes an image to each rendition width and encodes it as WebP. Returns {name: (width, webp bytes)}.
+def make_renditions(image):
+    # Photos taken by phones are often stored sideways with a rotation in their EXIF data
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    renditions = {}
+    for name, width in RENDITIONS.items():
+        resized = image.copy()
+        resized.thumbnail((width, width * 4), Image.LANCZOS)
+
+        output = io.BytesIO()
+        resized.save(output, 'WEBP', quality=WEBP_QUALITY, method=4)
+        renditions[name] = (resized.width, output.getvalue())
+    return renditions
+
+# Background job run after a post is created: makes the renditions of its image, uploads them and records their URLs on the post
+def process_post_image(post_id, key):
+    # The original is downloaded into a temporary file which only stays in memory while it is small
+    with SpooledTemporaryFile(max_size=4 * 1024 * 1024) as original:
+        download_stream(key, original)
+        original.seek(0)
+        with Image.open(original) as image:
+            # Only the header has been read so far
+            if image.width * image.height > MAX_IMAGE_PIXELS:
+                print(f"* Image {key} is {image.width} x {image.height} pixels, too large to make renditions of")
+                return
+            # JPEGs are decoded straight at a reduced scale, as long as both sides stay at least as large as the biggest rendition
+            largest = max(RENDITIONS.values())
+            image.draft('RGB', (largest, largest))
+            renditions = make_renditions(image)
+
+    urls = {}
+    for name, (width, data) in renditions.items():
+        put_object(rendition_key(key, name), data, 'image/webp', cache_control=RENDITION_CACHE_CONTROL)
+        urls[name] = {'url': public_url(rendition_key(key, name)), 'width': width}
+
+    database['posts'].update_one({'_id': post_id}, {'$set': {'renditions': urls}})
+    invalidate_feeds()
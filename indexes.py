@@ -0,0 +1,127 @@
+from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo.errors import OperationFailure
+import datetime
+from bson.objectid import ObjectId
+
+from models import CARD_PROJECTION
+from search import search_filter
+from utils import PAGE_SIZE, encode_cursor, cursor_filter
+
+# Every index the app's queries rely on, per collection. The listing indexes end with (created_at, _id) so that the
+# paginated feed, filter and profile queries are served in order straight from the index without an in-memory sort.
+INDEXES = {
+    'posts': [
+        ([('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+        ([('art_type', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+        ([('user_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+        # The trending feed, read in score order
+        ([('score', DESCENDING), ('_id', DESCENDING)], {}),
+        ([('art_type', ASCENDING), ('score', DESCENDING), ('_id', DESCENDING)], {}),
+        # The search index (see search.py). Stemming and stop words are turned off so prefixes match the way they are typed.
+        ([('post_title', TEXT), ('post_description', TEXT), ('art_type', TEXT), ('username', TEXT), ('search_prefixes', TEXT), ('author_prefixes', TEXT)],
+         {'name': 'post_search', 'default_language': 'none',
+          'weights': {'post_title': 10, 'art_type': 5, 'username': 5, 'search_prefixes': 2, 'author_prefixes': 2, 'post_description': 1}}),
+    ],
+    'users': [
+        ([('username', ASCENDING)], {'unique': True}),
+        ([('email', ASCENDING)], {'unique': True}),
+    ],
+    'likes': [
+        # One like per user and post. Also answers which posts of a page the user likes from the index alone.
+        ([('user_id', ASCENDING), ('post_id', ASCENDING)], {'unique': True}),
+        # Finds the likes of a deleted post
+        ([('post_id', ASCENDING)], {}),
+    ],
+    'saves': [
+        # One save per user and post, which also answers which posts of a page the user saved
+        ([('user_id', ASCENDING), ('post_id', ASCENDING)], {'unique': True}),
+        # The gallery, in the order the posts were saved
+        ([('user_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+        # Finds the saves of a deleted post
+        ([('post_id', ASCENDING)], {}),
+    ],
+    'sessions': [
+        # MongoDB removes the sessions stored by the "mongodb" session backend once they expire
+        ([('expires_at', ASCENDING)], {'expireAfterSeconds': 0}),
+    ],
+}
+
+# Creates any missing index. create_index is a no-op for indexes that already exist, so this is safe to run on every startup.
+# An index that can't be built (e.g. a unique index over existing duplicate usernames) is reported instead of stopping the app.
+def ensure_indexes(database):
+    failed = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                database[collection].create_index(keys, **options)
+            except OperationFailure as err:
+                print(f"* Failed to create index {keys} on {collection}:", err)
+                failed.append((collection, keys))
+    return failed
+
+# The shape of every hot query, built the same way as in the routes (filter, sort and page size, with and without a cursor)
+def query_shapes(database):
+    cursor = encode_cursor(datetime.datetime.utcnow(), ObjectId())
+    listing_sort = [('created_at', DESCENDING), ('_id', DESCENDING)]
+
+    shapes = []
+    for name, query in [('explore feed', {}),
+                        ('filter by art type', {'art_type': 'photography'}),
+                        ('profile and user page', {'user_id': str(ObjectId())})]:
+        shapes.append((name, database.posts.find(query).sort(listing_sort).limit(PAGE_SIZE + 1)))
+        next_query = {'$and': [query, cursor_filter(cursor)]} if query else cursor_filter(cursor)
+        shapes.append((name + ' (next page)', database.posts.find(next_query).sort(listing_sort).limit(PAGE_SIZE + 1)))
+
+    trending_sort = [('score', DESCENDING), ('_id', DESCENDING)]
+    trending_cursor = encode_cursor(1000.0, ObjectId())
+    for name, query in [('trending feed', {}), ('trending filter by art type', {'art_type': 'photography'})]:
+        shapes.append((name, database.posts.find(query).sort(trending_sort).limit(PAGE_SIZE + 1)))
+        next_query = {'$and': [query, cursor_filter(trending_cursor, 'score')]} if query else cursor_filter(trending_cursor, 'score')
+        shapes.append((name + ' (next page)', database.posts.find(next_query).sort(trending_sort).limit(PAGE_SIZE + 1)))
+
+    # Which posts of a page the user likes and saved (get_liked_post_ids / get_saved_post_ids)
+    user_id = str(ObjectId())
+    page_ids = [ObjectId() for _ in range(PAGE_SIZE)]
+    for collection in ('likes', 'saves'):
+        shapes.append((f"{collection} of a page", database[collection].find({'user_id': user_id, 'post_id': {'$in': page_ids}}, {'_id': 0, 'post_id': 1})))
+
+    # The gallery reads a page of saves with the $match / $sort / $limit at the start of its aggregation (gallery_page), which run as this query
+    gallery_sort = [('created_at', DESCENDING), ('_id', DESCENDING)]
+    shapes.append(('gallery', database.saves.find({'user_id': user_id}).sort(gallery_sort).limit(PAGE_SIZE + 1)))
+    shapes.append(('gallery (next page)', database.saves.find({'user_id': user_id, **cursor_filter(cursor)}).sort(gallery_sort).limit(PAGE_SIZE + 1)))
+    shapes.append(('all saved posts', database.saves.find({'user_id': user_id}, {'_id': 0, 'post_id': 1}).sort('created_at', -1)))
+
+    # Search, as in search_page
+    for name, tag in [('search', None), ('search filtered by art type', 'photography')]:
+        shapes.append((name, database.posts.find(search_filter('sunset', tag), {**CARD_PROJECTION, 'score': {'$meta': 'textScore'}})
+                       .sort([('score', {'$meta': 'textScore'}), ('created_at', -1)]).limit(PAGE_SIZE + 1)))
+
+    shapes.append(('user by username', database.users.find({'username': 'artroam'}).limit(1)))
+    shapes.append(('user by email', database.users.find({'email': 'artroam@example.com'}).limit(1)))
+    return shapes
+
+# Search results are ranked by relevance, which is computed for each match and can't be read from an index, so these shapes are
+# allowed to sort in memory (their matches still have to come from the text index). Searches never go past MAX_SEARCH_RESULTS.
+IN_MEMORY_SORT_ALLOWED = {'search', 'search filtered by art type'}
+
+# Returns the stages of a query plan (including all of their input stages)
+def plan_stages(plan):
+    # Newer servers nest the classic plan tree under queryPlan
+    plan = plan.get('queryPlan', plan)
+    stages = [plan.get('stage')]
+    children = plan.get('inputStages', [])
+    if 'inputStage' in plan:
+        children = children + [plan['inputStage']]
+    for child in children:
+        stages.extend(plan_stages(child))
+    return stages
+
+# Runs explain() on every query shape and returns the ones whose winning plan scans the whole collection or sorts in memory
+def check_query_plans(database):
+    problems = []
+    for name, cursor in query_shapes(database):
+        stages = plan_stages(cursor.explain()['queryPlanner']['winningPlan'])
+        bad_stages = [stage for stage in stages if stage == 'COLLSCAN' or (stage == 'SORT' and name not in IN_MEMORY_SORT_ALLOWED)]
+        if bad_stages:
+            problems.append((name, bad_stages))
+    return problems
@@ -0,0 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
+import time
+import traceback
+
+# Background worker pool for work that doesn't need to finish before the response is sent (e.g. resizing uploaded images, deleting files)
+def create_executor():
+    return ThreadPoolExecutor(max_workers=int(os.getenv('JOB_WORKERS', 4)), thread_name_prefix='artroam-jobs')
+
+executor = create_executor()
+
+# Threads don't survive a fork, so a worker process forked from a server which already ran jobs (e.g. gunicorn with preload_app)
+# starts with a pool of its own
+def reset_executor():
+    global executor
+    executor = create_executor()
+
+os.register_at_fork(after_in_child=reset_executor)
+
+# How many times a job is tried before giving up, and how long to wait before the first retry (doubled after each attempt)
+JOB_ATTEMPTS = int(os.getenv('JOB_ATTEMPTS', 3))
+RETRY_DELAY = 1.0
+
+# Prints the error of a job which failed, since nobody is waiting on its result
+def report_failure(future):
+    err = future.exception()
+    if err:
+        print('* Background job failed:', ''.join(traceback.format_exception(err)))
+
+# Calls fn until it succeeds, waiting a little longer after each failure. The last error is raised once all attempts are used.
+def run_with_retries(fn, args, kwargs, attempts=JOB_ATTEMPTS):
+    delay = RETRY_DELAY
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as err:
+            if attempt == attempts:
+                raise
+            print(f"* Background job {fn.__name__} failed (attempt {attempt} of {attempts}), retrying:", err)
+            time.sleep(delay)
+            delay *= 2
+
+# Runs fn(*args, **kwargs) on the worker pool, retrying it if it fails
+def submit(fn, *args, **kwargs):
+    future = executor.submit(run_with_retries, fn, args, kwargs)
+    future.add_done_callback(report_failure)
+    return future
+
+# A queue of items which are handled in batches by a background thread: the thread waits for the first item, then keeps collecting
+# items for up to max_wait seconds (or until max_size items) and passes them all to handler at once.
+# handler returns the items that failed, they are put back on the queue until they have been tried JOB_ATTEMPTS times.
+class BatchQueue:
+    def __init__(self, handler, max_size=1000, max_wait=0.5):
+        self.handler = handler
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.items = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def put(self, item, attempt=1):
+        self.items.put((item, attempt))
+        self.start()
+
+    # The thread is started on first use, so that it is started in each worker process of a pre-forking server
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='artroam-batch-queue', daemon=True)
+                self.thread.start()
+
+    def next_batch(self):
+        batch = [self.items.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.items.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            attempts = dict(batch)
+            try:
+                failed = self.handler(list(attempts)) or []
+            except Exception as err:
+                print('* Background batch failed:', err)
+                failed = list(attempts)
+
+            for item in failed:
+                if attempts[item] < JOB_ATTEMPTS:
+                    # Give the failure some time to clear before the item comes back in a batch
+                    threading.Timer(RETRY_DELAY * 2 ** (attempts[item] - 1), self.put, (item, attempts[item] + 1)).start()
+                else:
+                    print('* Giving up on background item:', item)
@@ -0,0 +1,264 @@
+from contextvars import ContextVar
+from pymongo import monitoring
+import bisect
+import json
+import os
+import threading
+import time
+
+from cache import cache
+from events import broker
+import db
+import ratelimit
+
+# Instrumentation of the app, exposed in the Prometheus text format by the /metrics route:
+# - how long each route takes (and how many requests it answered with each status)
+# - every MongoDB command (through a pymongo CommandListener) and every S3 call (through boto3 event hooks), overall and per request
+# - how long each template takes to render
+# - the cache, rate limit and live like count figures of the app
+# Requests slower than SLOW_REQUEST_MS are printed with the shapes (the query without its values) of the MongoDB commands they sent.
+
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 500))
+
+# Upper bounds (in seconds) of the histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds of the number of MongoDB commands per request
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 20, 50)
+
+# A Prometheus histogram: for every combination of label values, how many observations fell into each bucket, and their sum
+class Histogram:
+    def __init__(self, name, description, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            # Buckets are stored one by one here and added up when rendered
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((label_values, list(counts), count, total) for label_values, (counts, count, total) in self.series.items())
+        for label_values, counts, count, total in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{label_text(self.labels, label_values, le=format_number(bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{label_text(self.labels, label_values, le='+Inf')} {count}")
+            lines.append(f"{self.name}_sum{label_text(self.labels, label_values)} {format_number(total)}")
+            lines.append(f"{self.name}_count{label_text(self.labels, label_values)} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name, description, labels):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            series = sorted(self.series.items())
+        lines.extend(f"{self.name}{label_text(self.labels, label_values)} {value}" for label_values, value in series)
+        return lines
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def label_text(labels, label_values, **extra):
+    pairs = list(zip(labels, label_values)) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{label}="{escape(value)}"' for label, value in pairs) + '}'
+
+request_duration = Histogram('artroam_request_duration_seconds', 'Time taken to answer a request, per route.', ('route', 'method'))
+requests_total = Counter('artroam_requests_total', 'Requests answered, per route and status code.', ('route', 'method', 'status'))
+request_round_trips = Histogram('artroam_request_mongo_commands', 'MongoDB commands sent while answering a request, per route.',
+                                ('route',), ROUND_TRIP_BUCKETS)
+mongo_duration = Histogram('artroam_mongo_command_duration_seconds', 'Time taken by MongoDB commands, per command and collection.',
+                           ('command', 'collection'))
+mongo_failures = Counter('artroam_mongo_command_failures_total', 'MongoDB commands which failed, per command and collection.',
+                         ('command', 'collection'))
+s3_duration = Histogram('artroam_s3_request_duration_seconds', 'Time taken by S3 calls, per operation.', ('operation',))
+template_duration = Histogram('artroam_template_render_seconds', 'Time taken to render a template.', ('template',))
+
+# What happened during the request being answered: the MongoDB commands it sent (with their shapes) and the time spent in MongoDB and S3.
+# Commands of the async app (asgi.py) run on Motor's threads and are only counted in the overall metrics.
+class RequestTrace:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self.s3_calls = 0
+        self.s3_seconds = 0.0
+        self.shapes = []
+
+current_trace = ContextVar('current_trace', default=None)
+render_started_at = ContextVar('render_started_at', default=None)
+
+# The shape of a value: the keys and operators are kept, every value is replaced with "?"
+def value_shape(value):
+    if isinstance(value, dict):
+        return {key: value_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [value_shape(item) for item in value] if value and isinstance(value[0], (dict, list)) else '?'
+    return '?'
+
+# The parts of a command which decide how it is executed (e.g. the filter and sort of a find, the stages of an aggregation)
+SHAPE_FIELDS = ('filter', 'sort', 'q', 'pipeline', 'query', 'update')
+
+def command_shape(command_name, command):
+    collection = command.get(command_name)
+    parts = {field: value_shape(command[field]) for field in SHAPE_FIELDS if field in command}
+    for field in ('updates', 'deletes'):
+        if command.get(field):
+            parts[field] = value_shape(command[field][0])
+    return f"{command_name} {collection} {json.dumps(parts, separators=(',', ':'), default=str)}"
+
+# Times every MongoDB command. The collection is only known when the command starts, so it is kept until the command finishes.
+class CommandTimer(monitoring.CommandListener):
+    def __init__(self):
+        self.collections = {}
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        with self.lock:
+            self.collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ''
+        trace = current_trace.get()
+        if trace is not None:
+            trace.mongo_commands += 1
+            trace.shapes.append(command_shape(event.command_name, event.command))
+
+    def finished(self, event):
+        with self.lock:
+            collection = self.collections.pop((event.connection_id, event.request_id), '')
+        seconds = event.duration_micros / 1e6
+        mongo_duration.observe(seconds, event.command_name, collection)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.mongo_seconds += seconds
+        return collection
+
+    def succeeded(self, event):
+        self.finished(event)
+
+    def failed(self, event):
+        mongo_failures.inc(event.command_name, self.finished(event))
+
+# Listeners are passed to the MongoDB clients when they are created (see db.py)
+db.event_listeners.append(CommandTimer())
+
+# boto3 event hooks: the start time is kept in the context of the call, which is shared by its before-call and after-call events
+def before_s3_call(context, **kwargs):
+    context['metrics_started_at'] = time.perf_counter()
+
+def after_s3_call(model, context, **kwargs):
+    started_at = context.get('metrics_started_at')
+    if started_at is None:
+        return
+    seconds = time.perf_counter() - started_at
+    s3_duration.observe(seconds, model.name)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.s3_calls += 1
+        trace.s3_seconds += seconds
+
+db.s3_event_hooks.extend([('before-call.s3', before_s3_call), ('after-call.s3', after_s3_call)])
+
+# Records a request which has been answered (used by the Flask app and the endpoints of the ASGI app)
+def observe_request(route, method, status, seconds, trace=None):
+    request_duration.observe(seconds, route, method)
+    requests_total.inc(route, method, status)
+    if trace is not None:
+        request_round_trips.observe(trace.mongo_commands, route)
+
+    if seconds * 1000 >= SLOW_REQUEST_MS:
+        details = f" mongo: {trace.mongo_commands} commands in {trace.mongo_seconds * 1000:.1f} ms, s3: {trace.s3_calls} calls in {trace.s3_seconds * 1000:.1f} ms" if trace else ''
+        print(f"* Slow request: {method} {route} {status} took {seconds * 1000:.1f} ms.{details}")
+        for shape in (trace.shapes if trace else []):
+            print('    ', shape)
+
+# Adds the instrumentation to a Flask app
+def init_metrics(app):
+    from flask import before_render_template, request, template_rendered
+
+    @app.before_request
+    def start_trace():
+        request.environ['artroam.trace_token'] = current_trace.set(RequestTrace())
+
+    @app.after_request
+    def record_request(response):
+        trace = current_trace.get()
+        if trace is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            observe_request(route, request.method, response.status_code, time.perf_counter() - trace.started_at, trace)
+        return response
+
+    @app.teardown_request
+    def end_trace(exc=None):
+        token = request.environ.pop('artroam.trace_token', None)
+        if token is not None:
+            current_trace.reset(token)
+
+    def template_started(sender, template, context, **extra):
+        render_started_at.set(time.perf_counter())
+
+    def template_finished(sender, template, context, **extra):
+        started_at = render_started_at.get()
+        if started_at is not None:
+            template_duration.observe(time.perf_counter() - started_at, template.name or 'string')
+            render_started_at.set(None)
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+# The metrics of the app's other parts, read when /metrics is scraped
+def gauge(name, description, value, type='gauge'):
+    return [f"# HELP {name} {description}", f"# TYPE {name} {type}", f"{name} {value}"]
+
+def app_metrics():
+    stats = cache.stats()
+    hits = Counter('artroam_cache_hits_total', 'Cache lookups which found an entry, per kind of entry.', ('kind',))
+    misses = Counter('artroam_cache_misses_total', 'Cache lookups which found nothing, per kind of entry.', ('kind',))
+    hits.series = {(kind,): value for kind, value in stats['hits'].items()}
+    misses.series = {(kind,): value for kind, value in stats['misses'].items()}
+
+    events = broker.stats()
+    return (hits.render() + misses.render()
+            + gauge('artroam_cache_local_entries', 'Entries in the in-process cache.', stats['local_entries'])
+            + gauge('artroam_rate_limited_users_total', 'Likes and saves refused by the per user rate limit.', ratelimit.user_limiter.limited, 'counter')
+            + gauge('artroam_rate_limited_ips_total', 'Likes and saves refused by the per address rate limit.', ratelimit.ip_limiter.limited, 'counter')
+            + gauge('artroam_rate_limited_buttons_total', 'Likes and saves refused by the per user and post rate limit.', ratelimit.post_limiter.limited, 'counter')
+            + gauge('artroam_like_event_streams', 'Open live like count streams.', events['subscriptions'])
+            + gauge('artroam_like_event_posts', 'Posts followed by the open live like count streams.', events['posts']))
+
+# The /metrics page. Every app process keeps its own figures and answers with those, so with several gunicorn workers each scrape
+# shows the worker which happened to answer it (run one worker per container, or scrape the workers one by one).
+def render_metrics():
+    lines = []
+    for metric in (request_duration, requests_total, request_round_trips, mongo_duration, mongo_failures, s3_duration, template_duration):
+        lines.extend(metric.render())
+    lines.extend(app_metrics())
+    return '\n'.join(lines) + '\n'
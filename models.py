@@ -0,0 +1,53 @@
+# Read models of the listing pages (explore, search, filters, profiles and the gallery). A post card only shows a handful of a post's
+# fields, so the listing queries ask Mongo for those fields alone (CARD_PROJECTION) and decode each post into a small PostCard instead
+# of keeping the whole BSON document. Whatever else a post holds (search prefixes, or the users_that_like_post array of posts from
+# before likes had their own collection) is never sent over the wire, so a popular post costs no more to list than any other one.
+
+# The fields a post card needs. created_at and score are the fields the feeds are sorted by, their cursors are read from them.
+CARD_FIELDS = ('_id', 'user_id', 'username', 'avatar_url', 'post_title', 'post_description', 'art_type', 'image_url', 'renditions',
+               'likes', 'saves', 'created_at', 'score')
+CARD_PROJECTION = {field: 1 for field in CARD_FIELDS}
+
+# The fields of a user shown at the top of their profile page
+PROFILE_PROJECTION = {'username': 1, 'avatar_url': 1}
+
+# A post as shown on a card. The templates read its fields as attributes, the routes set the user's own like and save state on it
+# like on a dict (card['liked'] = True, card.update(state)). Cards are pickled into the shared cache tier like any other value.
+class PostCard:
+    __slots__ = CARD_FIELDS + ('liked', 'saved')
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field))
+
+    @classmethod
+    def from_document(cls, document):
+        return cls(**document)
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def __setitem__(self, field, value):
+        setattr(self, field, value)
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def update(self, fields):
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+    # Cached cards are shared by every request, so the routes get copies to add the user's own state to
+    def copy(self):
+        return PostCard(**{field: getattr(self, field) for field in self.__slots__})
+
+    def __getstate__(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+def post_cards(documents):
+    return [PostCard.from_document(document) for document in documents]
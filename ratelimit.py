@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+
+# Rate limits of the interaction endpoints (liking and saving posts). Each client gets a token bucket: every request takes a token,
+# tokens come back at `rate` per second, and up to `burst` of them can be saved up. A request which finds the bucket empty is answered
+# with 429 Too Many Requests before it reaches the database.
+# Requests are limited both per logged in user and per IP address, so neither opening new sessions nor spreading the clicks of one
+# account over many addresses gets around the limit. The buckets live in the memory of each app process.
+INTERACTION_RATE = float(os.getenv('INTERACTION_RATE', 5))
+INTERACTION_BURST = int(os.getenv('INTERACTION_BURST', 20))
+
+# Addresses are shared by whole offices or mobile networks, so they get more room than a single user
+IP_RATE = float(os.getenv('INTERACTION_IP_RATE', 20))
+IP_BURST = int(os.getenv('INTERACTION_IP_BURST', 60))
+
+# Each user also gets a small bucket per post (one for its like button, one for its save button). explore.js only sends the state a
+# button ends up in once the user stops clicking, but a script calling the endpoints directly could otherwise flip the same like back
+# and forth (a write each time) as fast as the per user limit allows. A person settles on a state well within these limits.
+POST_RATE = float(os.getenv('INTERACTION_POST_RATE', 1))
+POST_BURST = int(os.getenv('INTERACTION_POST_BURST', 4))
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    # Takes a token. Returns 0 if one was available, otherwise how many seconds until the next one.
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+# One token bucket per key (e.g. "user:<id>"). Only the most recently used max_keys buckets are kept, a forgotten bucket was full anyway
+# unless its client was active within the last few seconds.
+class RateLimiter:
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.limited = 0
+
+    # Returns 0 if the request may go ahead, otherwise how many seconds the client should wait before retrying
+    def check(self, key):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+                while len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            self.buckets.move_to_end(key)
+
+            retry_after = bucket.take(time.monotonic())
+            if retry_after:
+                self.limited += 1
+            return retry_after
+
+user_limiter = RateLimiter(INTERACTION_RATE, INTERACTION_BURST)
+ip_limiter = RateLimiter(IP_RATE, IP_BURST)
+post_limiter = RateLimiter(POST_RATE, POST_BURST)
+
+# Checks the limits of a like or save request. `button` is what the request changes, e.g. "like:<post id>".
+# Returns 0 if it may go ahead, otherwise the number of seconds for the Retry-After header.
+def interaction_retry_after(user_id, ip, button=None):
+    retry_after = ip_limiter.check(f"ip:{ip}")
+    if not retry_after and user_id:
+        retry_after = user_limiter.check(f"user:{user_id}")
+    if not retry_after and user_id and button:
+        retry_after = post_limiter.check(f"user:{user_id}:{button}")
+    return retry_after
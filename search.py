@@ -0,0 +1,87 @@
+from pymongo import UpdateOne
+import re
+
+from models import CARD_PROJECTION
+from utils import PAGE_SIZE
+
+# Search for the explore page. Posts are found through a MongoDB text index (see indexes.py) over the title, description, art type and
+# author, and are ranked by relevance. Whole words in the title count the most, so "sunset" ranks a post called "Sunset" above one that
+# only mentions a sunset in its description. Text indexes only match whole words, so each post also stores the prefixes of the words in its
+# title, art type and author name: typing "sun" matches those prefixes and still finds "Sunset".
+
+# Only the first pages of a search are served: past that point the results are not relevant anymore and skipping gets slower
+MAX_SEARCH_RESULTS = 20 * PAGE_SIZE
+
+MIN_PREFIX_LENGTH = 2
+
+# Splits a text into lowercase words, anything that isn't a letter or a digit is dropped (so user input can't use $text operators)
+def tokenize(text):
+    return re.findall(r'[^\W_]+', (text or '').lower())
+
+# Returns the prefixes (at least MIN_PREFIX_LENGTH characters long) of every word in the texts
+def word_prefixes(*texts):
+    prefixes = set()
+    for text in texts:
+        for word in tokenize(text):
+            for end in range(MIN_PREFIX_LENGTH, len(word) + 1):
+                prefixes.add(word[:end])
+    return sorted(prefixes)
+
+# The search fields stored on a post document, given its title and art type ("digital_art" is searchable as "digital art")
+def post_search_fields(post_title, art_type):
+    return {'search_prefixes': word_prefixes(post_title, (art_type or '').replace('_', ' '))}
+
+# The search fields which depend on the author, they are updated on all of the user's posts when the username changes
+def author_search_fields(username):
+    return {'author_prefixes': word_prefixes(username)}
+
+# Builds the Mongo filter for a search, optionally restricted to one art type (the /filter/<tag> facet)
+def search_filter(search_query, tag=None):
+    words = tokenize(search_query)
+    if not words:
+        return None
+
+    query = {'$text': {'$search': ' '.join(words)}}
+    if tag:
+        query['art_type'] = tag
+    return query
+
+# Search results are ordered by relevance rather than by date, so their cursors are offsets ("o<number of results already shown>")
+def decode_search_cursor(cursor):
+    if cursor and cursor.startswith('o') and cursor[1:].isdigit():
+        return int(cursor[1:])
+    return 0
+
+# Returns one page of search results, best match first, and the cursor for the next page (None on the last page).
+# Only the card fields of the posts are read, their score is the relevance of the post.
+def search_page(collection, search_query, tag=None, cursor=None, limit=PAGE_SIZE):
+    query = search_filter(search_query, tag)
+    offset = decode_search_cursor(cursor)
+    if query is None or offset >= MAX_SEARCH_RESULTS:
+        return [], None
+
+    posts = list(collection.find(query, {**CARD_PROJECTION, 'score': {'$meta': 'textScore'}})
+                 .sort([('score', {'$meta': 'textScore'}), ('created_at', -1)])
+                 .skip(offset)
+                 .limit(limit + 1))
+
+    if len(posts) <= limit or offset + limit >= MAX_SEARCH_RESULTS:
+        return posts[:limit], None
+    return posts[:limit], f"o{offset + limit}"
+
+# Fills in the search fields of posts created before search was added, in batches
+def backfill_search_fields(collection, batch_size=500):
+    updated = 0
+    batch = []
+    for post in collection.find({'search_prefixes': {'$exists': False}}, {'post_title': 1, 'art_type': 1, 'username': 1}):
+        fields = post_search_fields(post.get('post_title'), post.get('art_type'))
+        fields.update(author_search_fields(post.get('username')))
+        batch.append(UpdateOne({'_id': post['_id']}, {'$set': fields}))
+
+        if len(batch) == batch_size:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+    return updated
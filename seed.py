@@ -0,0 +1,186 @@
+from bson import json_util
+from bson.objectid import ObjectId
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pymongo.errors import BulkWriteError
+from werkzeug.security import generate_password_hash
+import datetime
+import io
+import random
+import time
+
+from search import post_search_fields, author_search_fields
+from images import RENDITION_CACHE_CONTROL
+from storage import public_url, put_object
+from utils import trending_score
+
+# Synthetic data for capacity testing and local stand-in environments (`flask seed generate` / `flask seed import`, see app.py).
+# Documents are generated (or read) one at a time and written in batches with insert_many, so memory use stays the same however many
+# millions of documents are loaded. Placeholder images are uploaded to the bucket by a pool of threads while the documents are written.
+#
+# Users and posts get ids computed from their position, so generating likes and saves never needs to remember which users and posts
+# exist. The same seed always generates the same data.
+
+ART_TYPES = ('digital_art', 'photography', 'visual_art')
+WORDS = ('sunset', 'portrait', 'city', 'ocean', 'forest', 'mountain', 'street', 'abstract', 'light', 'shadow', 'river', 'winter',
+         'summer', 'flower', 'night', 'study', 'colour', 'sketch', 'dream', 'garden', 'market', 'harbour', 'rain', 'desert',
+         'bridge', 'window', 'morning', 'autumn', 'spring', 'cloud', 'stone', 'glass', 'paper', 'mirror', 'island', 'train')
+
+# Every generated user has this password
+PASSWORD = 'artroam'
+
+# Posts are spread over the year before this date
+LATEST_POST = datetime.datetime(2024, 1, 1)
+
+# Generated ids: a fixed timestamp (so they sort after real ids created before 2023), a kind and the position
+USER_ID_PREFIX = 0x63b0cd00_01
+POST_ID_PREFIX = 0x63b0cd00_02
+
+def generated_id(prefix, position):
+    return ObjectId(f"{prefix:010x}{position:014x}")
+
+def user_id(position):
+    return generated_id(USER_ID_PREFIX, position)
+
+def post_id(position):
+    return generated_id(POST_ID_PREFIX, position)
+
+def username(position):
+    return f"{WORDS[position % len(WORDS)]}_{position}"
+
+def placeholder_key(position):
+    return f"placeholders/{position}.jpg"
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+# A number of likes / saves with the given average: most posts get a few, some get many
+def engagement(rng, average, limit):
+    return min(int(rng.expovariate(1 / average)), limit) if average > 0 else 0
+
+# legacy=True generates the documents the way older versions of the app stored them (saved posts in the users' `favorites` arrays),
+# to load test `flask migrate-saves`
+def generate_users(rng, users, posts, saves, legacy=False):
+    password = generate_password_hash(PASSWORD)
+    for position in range(users):
+        user = {'_id': user_id(position), 'username': username(position), 'email': f"{username(position)}@example.com",
+                'password': password, 'avatar_url': None}
+        if legacy and posts:
+            # saves is the average per post, spread over the users
+            user['favorites'] = [post_id(rng.randrange(posts)) for _ in range(engagement(rng, saves * posts / users, posts))]
+        yield user
+
+# Posts, with the like and save documents of each post added to `likes` and `saves` (legacy=True stores the likes in the posts'
+# `users_that_like_post` arrays instead, to load test `flask migrate-likes`)
+def generate_posts(rng, users, posts, likes, saves, like_documents, save_documents, images=0, legacy=False):
+    for position in range(posts):
+        author = rng.randrange(users)
+        title = sentence(rng, rng.randint(1, 4)).capitalize()
+        art_type = rng.choice(ART_TYPES)
+        created_at = LATEST_POST - datetime.timedelta(seconds=rng.randrange(365 * 24 * 3600))
+        likers = [str(user_id(liker)) for liker in rng.sample(range(users), engagement(rng, likes, users))]
+        savers = [] if legacy else [str(user_id(saver)) for saver in rng.sample(range(users), engagement(rng, saves, users))]
+
+        post = {'_id': post_id(position), 'user_id': str(user_id(author)), 'username': username(author), 'avatar_url': None,
+                'likes': len(likers), 'saves': len(savers), 'post_title': title, 'post_description': sentence(rng, 12),
+                'image_url': public_url(placeholder_key(position % images)) if images else None, 'art_type': art_type,
+                'created_at': created_at, 'score': trending_score(len(likers), len(savers), created_at)}
+        post.update(post_search_fields(title, art_type))
+        post.update(author_search_fields(username(author)))
+
+        if legacy:
+            post['users_that_like_post'] = likers
+        else:
+            like_documents.extend({'user_id': liker, 'post_id': post['_id'], 'created_at': created_at} for liker in likers)
+            save_documents.extend({'user_id': saver, 'post_id': post['_id'], 'created_at': created_at} for saver in savers)
+        yield post
+
+# Writes the documents in batches of batch_size. Documents which already exist are skipped, so an interrupted load can be run again.
+# Returns how many documents were inserted.
+def insert_batch(collection, batch):
+    if not batch:
+        return 0
+    try:
+        return len(collection.insert_many(batch, ordered=False).inserted_ids)
+    except BulkWriteError as err:
+        return err.details['nInserted']
+
+def insert_batches(collection, documents, batch_size=1000, progress=None):
+    inserted = 0
+    documents = iter(documents)
+    while True:
+        batch = list(islice(documents, batch_size))
+        if not batch:
+            return inserted
+        inserted += insert_batch(collection, batch)
+        if progress:
+            progress(collection.name, inserted)
+
+# A placeholder image: a flat colour picked from its position, so every image is different
+def placeholder_image(position, size=(1200, 900)):
+    from PIL import Image
+    rng = random.Random(position)
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (rng.randrange(256), rng.randrange(256), rng.randrange(256))).save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+def upload_placeholder(position):
+    put_object(placeholder_key(position), placeholder_image(position), 'image/jpeg', cache_control=RENDITION_CACHE_CONTROL)
+
+# Uploads the placeholder images on a pool of threads. Returns the executor and the futures of the uploads.
+def start_uploads(images, workers=16):
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='artroam-seed-upload')
+    return executor, [executor.submit(upload_placeholder, position) for position in range(images)]
+
+# Generates users, posts, likes and saves into the database and uploads `images` placeholder images for the posts.
+# likes and saves are the average number of likes / saves per post. Returns the number of documents inserted per collection.
+def generate(database, users, posts, likes=3, saves=1, images=0, batch_size=1000, legacy=False, seed=0, upload_workers=16, progress=None):
+    rng = random.Random(seed)
+    counts = {}
+    executor, uploads = start_uploads(images, upload_workers) if images else (None, [])
+    try:
+        counts['users'] = insert_batches(database.users, generate_users(rng, users, posts, saves, legacy), batch_size, progress)
+
+        # The likes and saves of each batch of posts are written right after it
+        like_documents, save_documents = [], []
+        generated = generate_posts(rng, users, posts, likes, saves, like_documents, save_documents, images, legacy)
+        counts.update(posts=0, likes=0, saves=0)
+        while True:
+            batch = list(islice(generated, batch_size))
+            if not batch:
+                break
+            counts['posts'] += insert_batch(database.posts, batch)
+            for name, documents in (('likes', like_documents), ('saves', save_documents)):
+                for start in range(0, len(documents), batch_size):
+                    counts[name] += insert_batch(database[name], documents[start:start + batch_size])
+                documents.clear()
+            if progress:
+                progress('posts', counts['posts'])
+
+        for upload in uploads:
+            upload.result()
+        counts['images'] = len(uploads)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    return counts
+
+# Streams the documents of a JSON Lines file (one MongoDB extended JSON document per line, e.g. from `mongoexport`) into a collection
+def read_documents(file):
+    for line in file:
+        if line.strip():
+            yield json_util.loads(line)
+
+def import_file(collection, file, batch_size=1000, progress=None):
+    return insert_batches(collection, read_documents(file), batch_size, progress)
+
+# Prints the number of documents written at most every few seconds
+def progress_printer(echo, interval=5):
+    last = {}
+
+    def progress(name, count):
+        now = time.monotonic()
+        if now - last.get(name, 0) >= interval:
+            last[name] = now
+            echo(f"  {name}: {count}")
+    return progress
@@ -0,0 +1,117 @@
+from flask.sessions import SessionInterface, SessionMixin
+from flask_session import Session
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+import datetime
+import secrets
+
+# Session backends, chosen with the SESSION_BACKEND environment variable:
+# - "filesystem": Flask-Session files on the local disk (the default). Sessions only work with a single server.
+# - "mongodb": sessions are documents in the `sessions` collection, removed by a TTL index once they expire. Shared by every app process.
+# - "cookie": the whole session is stored in a signed cookie (Flask's default). Nothing is stored on the server at all.
+SESSION_BACKENDS = ('filesystem', 'mongodb', 'cookie')
+
+class MongoSession(CallbackDict, SessionMixin):
+    # Whether the cookie outlives the browser (SESSION_PERMANENT). Kept on the session object rather than in its data.
+    permanent = True
+
+    def __init__(self, initial=None, sid=None, new=False, permanent=True, expires_at=None):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.permanent = permanent
+        # When the stored session expires
+        self.expires_at = expires_at
+        self.modified = False
+
+# Stores sessions in MongoDB. The cookie only holds the (signed) session id. The session document is only written when the session
+# was changed during the request, so requests which only read the session cost a single indexed find_one.
+# Like the filesystem backend, sessions are permanent unless SESSION_PERMANENT is False: the cookie lasts PERMANENT_SESSION_LIFETIME.
+# A session which is used without being changed has its expiry (and cookie) moved forward once it was last written more than
+# REFRESH_AFTER ago, so active users aren't logged out PERMANENT_SESSION_LIFETIME after they last changed their session.
+class MongoSessionInterface(SessionInterface):
+    REFRESH_AFTER = datetime.timedelta(days=1)
+
+    def __init__(self, database, collection_name='sessions'):
+        self.database = database
+        self.collection_name = collection_name
+
+    # Looked up on every request so each process uses its own database client (see db.py)
+    @property
+    def collection(self):
+        return self.database[self.collection_name]
+
+    def signer(self, app):
+        return Signer(app.secret_key, salt='artroam-session')
+
+    # Returns the session id held by the cookie, or None if it wasn't signed by this app
+    def session_id(self, app, signed_sid):
+        try:
+            return self.signer(app).unsign(signed_sid).decode()
+        except BadSignature:
+            return None
+
+    # Query for the stored session with this id, if it hasn't expired
+    def session_filter(self, sid):
+        return {'_id': sid, 'expires_at': {'$gt': datetime.datetime.utcnow()}}
+
+    def open_session(self, app, request):
+        permanent = app.config.get('SESSION_PERMANENT', True)
+        signed_sid = request.cookies.get(self.get_cookie_name(app))
+        if signed_sid:
+            sid = self.session_id(app, signed_sid)
+            if sid:
+                document = self.collection.find_one(self.session_filter(sid))
+                if document:
+                    return MongoSession(document.get('data'), sid=sid, permanent=permanent, expires_at=document['expires_at'])
+
+        return MongoSession(sid=secrets.token_urlsafe(32), new=True, permanent=permanent)
+
+    # Whether an unchanged session was last written more than REFRESH_AFTER ago (or half its lifetime, for short lifetimes)
+    def needs_refresh(self, app, session, now):
+        if session.new or session.expires_at is None:
+            return False
+        refresh_after = min(self.REFRESH_AFTER, app.permanent_session_lifetime / 2)
+        return session.expires_at - now < app.permanent_session_lifetime - refresh_after
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # The session was emptied (e.g. on logout), so we remove it
+        if not session:
+            if session.modified and not session.new:
+                self.collection.delete_one({'_id': session.sid})
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = datetime.datetime.utcnow()
+        expires_at = now + app.permanent_session_lifetime
+        if session.modified:
+            self.collection.replace_one({'_id': session.sid}, {'data': dict(session), 'expires_at': expires_at}, upsert=True)
+        elif self.needs_refresh(app, session, now):
+            self.collection.update_one({'_id': session.sid}, {'$set': {'expires_at': expires_at}})
+        else:
+            return
+
+        response.set_cookie(name, self.signer(app).sign(session.sid).decode(),
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+# Sets up the session backend of the app
+def init_session(app, database, backend='filesystem'):
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f"Unknown session backend {backend!r}, expected one of {', '.join(SESSION_BACKENDS)}")
+
+    if backend == 'filesystem':
+        app.config['SESSION_TYPE'] = 'filesystem'
+        Session().init_app(app)
+    elif backend == 'mongodb':
+        app.session_interface = MongoSessionInterface(database)
+    # The "cookie" backend is Flask's own session interface, which also only sets the cookie when the session changed
@@ -75,35 +75,58 @@ retakeButton.addEventListener('click', () => {
     isCaptured = false;
 });
 
-// Sends the image to the server using XMLHttpRequest
-function sendImageToServer(imageData) {
-const xhr = new XMLHttpRequest();
-xhr.open('POST', '/create', true);
-xhr.setRequestHeader('Content-Type', 'application/json');
-
-xhr.onreadystatechange = () => {
-    if (xhr.readyState === 4) {
-        if (xhr.status === 200) {
-            const response = JSON.parse(xhr.responseText);
-            if (response.redirect) {
-                window.location.href = response.redirect;
-            } else {
-                console.log('Image uploaded but no redirect provided.');
-            }
-        } else {
-            console.error('Image upload failed.');
+// Sends the image to the server. The server only hands out a presigned URL (/upload_url), the image itself is uploaded
+// straight to the AWS S3 Bucket and then the server is told the upload is done (/create) so it can redirect to the post page.
+function sendImageToServer(imageBlob) {
+    fetch('/upload_url', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ content_type: imageBlob.type })
+    })
+    .then((response) => response.json())
+    .then((data) => {
+        if (data.redirect) {
+            window.location.href = data.redirect;
+            return;
         }
-    }
-};    
-const data = JSON.stringify({ image: imageData });
-xhr.send(data);
+        if (!data.upload) {
+            throw new Error(data.error || 'No upload URL provided.');
+        }
+
+        // S3 expects the presigned fields first and the file last
+        const form = new FormData();
+        Object.entries(data.upload.fields).forEach(([name, value]) => form.append(name, value));
+        form.append('file', imageBlob);
+
+        return fetch(data.upload.url, { method: 'POST', body: form })
+            .then((uploadResponse) => {
+                if (!uploadResponse.ok) {
+                    throw new Error('Upload to storage failed.');
+                }
+                return fetch('/create', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ key: data.key })
+                });
+            })
+            .then((createResponse) => createResponse.json())
+            .then((response) => {
+                if (response.redirect) {
+                    window.location.href = response.redirect;
+                } else {
+                    console.log('Image uploaded but no redirect provided.');
+                }
+            });
+    })
+    .catch((error) => {
+        console.error('Image upload failed.', error);
+    });
 }
 
 // If clicked on the next button, it will send the image to the server. 
 nextButton.addEventListener('click', () => {
     if (isCaptured) {
-        const imageBase64 = capturedPhoto.toDataURL('image/jpeg');
-        sendImageToServer(imageBase64);
+        capturedPhoto.toBlob((imageBlob) => sendImageToServer(imageBlob), 'image/jpeg');
     }
 });
 
@@ -112,16 +135,11 @@ uploadPhotoButton.addEventListener('click', () => {
     // fileInput.click();
 });
 
-// This checks if the file is an image file and converts it to base64-encoded string and sends to the server. 
+// This sends the selected image file to the server as is (the server checks that it is an image). 
 fileInput.addEventListener('change', (event) => {
     const selectedFile = event.target.files[0];
     if (selectedFile) {
-        const reader = new FileReader();
-        reader.onload = function () {
-            const imageBase64 = reader.result;
-            sendImageToServer(imageBase64);
-        };
-        reader.readAsDataURL(selectedFile);
+        sendImageToServer(selectedFile);
     }
 });
     // When the page loads, show the options first
@@ -1,162 +1,288 @@
-// Function which starts at the beginning to store which posts the user has saved.
-function loadSavedPosts() {
-    $("button[name='saveButton']").each(function () {
-        var postID = $(this).data('post-id');
-        var button = $(this);
+// The like counts and the liked / saved colours of the buttons are rendered by the server together with the posts.
+// This function refreshes them for every post inside root with a single request, e.g. when the browser restores the page from its cache.
+function loadPostStates(root) {
+    var postIDs = $(root).find("button[name='likeButton']").map(function () {
+        return $(this).data('post-id');
+    }).get();
+
+    if (postIDs.length === 0) {
+        return;
+    }
+
+    $.ajax({
+        url: "/post_states",
+        method: "GET",
+        data: { ids: postIDs.join(",") },
+        success: function (data) {
+            $.each(data.states, function (postID, state) {
+                $(".like-count[data-post-id='" + postID + "']").text(state.likes);
+                showLiked($("button[name='likeButton'][data-post-id='" + postID + "']").data("server-liked", state.liked), state.liked);
+                showSaved($("button[name='saveButton'][data-post-id='" + postID + "']").data("server-saved", state.saved), state.saved);
+            });
+        },
+        error: function (err) {
+            console.log('Error loading post states:', err);
+        }
+    });
+}
+
+function showLiked(button, liked) {
+    button.data("liked", liked).css("background-color", liked ? "#ff4c4c" : "#FFA500");
+}
+
+function showSaved(button, saved) {
+    button.data("saved", saved).css("background-color", saved ? "#fdd68f" : "#FFA500");
+}
+
+// Clicking the like or save button changes the button straight away, the state the user ends up with is only sent to the server once
+// they stopped clicking for SEND_DELAY milliseconds. Clicking a button many times in a row sends a single request (and none at all if
+// the button ends up as it was), and the request asks for a state (?liked=true) rather than a toggle, so it can safely be repeated.
+var SEND_DELAY = 400;
+var pendingSends = {};
+
+function sendLater(key, send) {
+    clearTimeout(pendingSends[key]);
+    pendingSends[key] = setTimeout(function () {
+        delete pendingSends[key];
+        send();
+    }, SEND_DELAY);
+}
+
+// The state last confirmed by the server, which is the one rendered with the page until the first request
+function serverState(button, name) {
+    if (button.data("server-" + name) === undefined) {
+        button.data("server-" + name, button.data(name) === true);
+    }
+    return button.data("server-" + name);
+}
+
+function sendLike(button) {
+    var postID = button.data('post-id');
+    var liked = button.data("liked") === true;
+    if (liked === serverState(button, "liked")) {
+        return;
+    }
+
+    $.ajax({
+        url: "/like_post/" + postID + "?liked=" + liked,
+        method: "POST",
+
+        // When AJAX request is a success:
+        success: function (data) {
 
-        $.ajax({
-            url: "/get_saved_posts",
-            method: "GET",
-            success: function (data) {
-                var savedPosts = data.saved_posts;
-                if (savedPosts.includes(postID)) {
-                    button.css("background-color", "#fdd68f");
-                } else {
-                    button.css("background-color", "#FFA500");
-                }
-            },
-            error: function (err) {
-                console.log('Error loading saved posts:', err);
+            if (data.redirect) {
+                window.location.href = data.redirect;  // Redirect to the URL sent by the server which would be the login page if the user_id is None.
+                return;
             }
-        });
+
+            button.data("server-liked", data.liked);
+            // The user may have clicked again while the request was on its way, the next request will send that
+            if (!pendingSends["like:" + postID]) {
+                $(".like-count[data-post-id='" + postID + "']").text(data.likes);
+                showLiked(button, data.liked);
+            }
+        },
+
+        // e.g. 429 when the user clicked faster than the rate limit allows: the button goes back to what the server has
+        error: function (xhr, status, error) {
+            console.log("Error status: " + status);
+            console.log("Error message: " + error);
+            loadPostStates(button.parent());
+        }
     });
 }
 
+function sendSave(button) {
+    var postID = button.data('post-id');
+    var saved = button.data("saved") === true;
+    if (saved === serverState(button, "saved")) {
+        return;
+    }
 
+    $.ajax({
+        url: "/save_post/" + postID + "?saved=" + saved,
+        method: "POST",
 
+        // When AJAX request is a success:
+        success: function (data) {
 
-// This is a function which starts at the very beginning when the webpage is loaded. 
-function loadLikeCounts() {
-    $("button[name='likeButton']").each(function () {
-        var postID = $(this).data('post-id');
-        
-        // Here we use AJAX to get the like counts for each post
-        $.ajax({
-            url: "/get_like_count/" + postID,
-            method: "GET",
-            success: function (data) {
-                var likeCount = $(".like-count[data-post-id='" + postID + "']");
+            if (data.redirect) {
+                window.location.href = data.redirect;  // Redirect to the URL sent by the server which would be the login page if the user_id is None.
+                return;
+            }
 
-                if (likeCount) {
-                    likeCount.text(data.likes);
-                }
-            },
-            error: function (err) {
-                console.log('Error loading like counts:', err);
+            button.data("server-saved", data.saved);
+            if (!pendingSends["save:" + postID]) {
+                showSaved(button, data.saved);
             }
-        });
+        },
+
+        error: function (err) {
+            console.log('Error saving post:', err);
+            loadPostStates(button.parent());
+        }
     });
 }
 
-// This is a function which starts at the very beginning when the webpage is laoded. 
-function loadLikedPosts() {
-    $("button[name='likeButton']").each(function () {
-        var button = $(this);
-        var postID = button.data('post-id'); // Get the post ID associated with the current button
-
-        // Here we use AJAX to get the user's liked posts
-        $.ajax({
-            url: "/get_liked_posts/" + postID,
-            method: "GET",
-            success: function (data) {
-                var usersThatLikedPost = data.users_that_liked_post;
-                var userInSession = data.user_in_session;
-
-                // If the user is in the usersThatLikedPost array, it indicates they have liked the post before
-                if (usersThatLikedPost.includes(userInSession)) {
-                    button.css("background-color", "#ff4c4c");  
-                } else {
-                    button.css("background-color", "#FFA500");
-                }
-            },
-            error: function (err) {
-                console.log('Error loading liked posts:', err);
+// Live like counts: the page keeps a Server-Sent Events stream open (/events/likes) for the posts currently on screen, and the server
+// pushes the new count of any of them as soon as someone likes or unlikes it. When the user scrolls to other posts the stream is
+// reopened for those (once scrolling settled down for SUBSCRIBE_DELAY milliseconds).
+// Only the ASGI app serves the stream, the Flask app answers 204: the stream is then closed for good and never asked for again.
+var SUBSCRIBE_DELAY = 1000;
+var visiblePosts = {};
+var likeEvents = null;
+var likeEventsUnavailable = false;
+var subscribedIDs = "";
+var subscribeTimer = null;
+
+function subscribeLikes() {
+    var ids = Object.keys(visiblePosts).sort().join(",");
+    if (ids === subscribedIDs || likeEventsUnavailable) {
+        return;
+    }
+    subscribedIDs = ids;
+
+    if (likeEvents) {
+        likeEvents.close();
+        likeEvents = null;
+    }
+    if (!ids || !window.EventSource) {
+        return;
+    }
+
+    var opened = false;
+    var stream = likeEvents = new EventSource("/events/likes?ids=" + ids);
+    stream.addEventListener("open", function () {
+        opened = true;
+    });
+    stream.addEventListener("error", function () {
+        // A stream the server refused (rather than one which dropped and is reconnecting) is closed by the browser
+        if (!opened && stream.readyState === EventSource.CLOSED) {
+            likeEventsUnavailable = true;
+            likeEvents = null;
+        }
+    });
+    stream.addEventListener("likes", function (event) {
+        $.each(JSON.parse(event.data), function (postID, likes) {
+            // The user's own click which hasn't been sent yet shows its count until the server answers
+            if (!pendingSends["like:" + postID]) {
+                $(".like-count[data-post-id='" + postID + "']").text(likes);
             }
         });
     });
 }
 
+var cardObserver = window.IntersectionObserver ? new IntersectionObserver(function (entries) {
+    $.each(entries, function (i, entry) {
+        var postID = $(entry.target).data("post-id");
+        if (entry.isIntersecting) {
+            visiblePosts[postID] = true;
+        } else {
+            delete visiblePosts[postID];
+        }
+    });
+    clearTimeout(subscribeTimer);
+    subscribeTimer = setTimeout(subscribeLikes, SUBSCRIBE_DELAY);
+}) : null;
 
-// When the HTML page loads do the following: 
-$(document).ready(function () {
-    // When the likeButton is pressed, it will get the postID from the like button associated with the post
-    $("button[name='likeButton']").click(function () {
-        var postID = $(this).data('post-id');
-        var button = $(this); //Reference to the button clicked
-        var likeCount = $(".like-count[data-post-id='" + postID + "']"); //Reference for the likeCount for the post
+// Starts following the like counts of the cards inside root
+function watchCards(root) {
+    if (!cardObserver) {
+        return;
+    }
+    $(root).find("button[name='likeButton']").each(function () {
+        cardObserver.observe(this);
+    });
+}
+
+// The explore page only renders the first page of posts, this fetches the next page from /feed once the user scrolls near the bottom
+var loadingNextPage = false;
 
-        // Here we use AJAX to update the webpage in real time, no reloading page
-        $.ajax({
-            url: "/like_post/" + postID,
-            method: "POST",
+function loadNextPage() {
+    var feed = $("#feed");
+    var nextCursor = feed.data("next-cursor");
 
-            // When AJAX request is a success:
-            success: function (data) {
+    if (loadingNextPage || !nextCursor) {
+        return;
+    }
+    loadingNextPage = true;
 
-                if (data.redirect) {
-                    window.location.href = data.redirect;  // Redirect to the URL sent by the server which would be the login page if the user_id is None.
-                }
+    $.ajax({
+        url: feed.data("feed-url"),
+        method: "GET",
+        data: { cursor: nextCursor },
+        success: function (data) {
+            var cards = $($.parseHTML(data.html));
+            feed.append(cards);
+            watchCards(cards);
 
-                // Updates the like value in realtime on the webpage
-                if (likeCount) {
-                    likeCount.text(data.likes);
-                }
+            // An empty cursor means we reached the oldest post
+            feed.data("next-cursor", data.next_cursor || "");
+            loadingNextPage = false;
+        },
+        error: function (err) {
+            console.log('Error loading the next page:', err);
+            loadingNextPage = false;
+        }
+    });
+}
 
-                // If the data is liked, it changes the colour to Yellow, if not, it removes the colour. 
-                if (data.liked) {
-                    button.css("background-color", "#ff4c4c");  
-                } else {
-                    button.css("background-color", "#FFA500");
-                }
-            },
 
+// When the HTML page loads do the following: 
+$(document).ready(function () {
+    // When the likeButton is pressed, the button and the like count change right away and the like is sent once the user stops clicking
+    // (the handlers are attached to the document so that they also work for cards added by infinite scrolling)
+    $(document).on("click", "button[name='likeButton']", function () {
+        var button = $(this); //Reference to the button clicked
+        var postID = button.data('post-id');
+        var likeCount = $(".like-count[data-post-id='" + postID + "']"); //Reference for the likeCount for the post
+        var liked = !(button.data("liked") === true);
 
-            error: function (xhr, status, error) {
-                console.log("Error status: " + status);
-                console.log("Error message: " + error);
-            }
+        serverState(button, "liked");
+        showLiked(button, liked);
+        likeCount.text(Number(likeCount.text()) + (liked ? 1 : -1));
+        sendLater("like:" + postID, function () {
+            sendLike(button);
         });
     });
 
-    // This is a function for the save button
-    $("button[name='saveButton']").click(function() {
-        var postID = $(this).data('post-id');
+    // This is a function for the save button, which works the same way
+    $(document).on("click", "button[name='saveButton']", function() {
         var button = $(this);
-        
-        $.ajax({
-            url: "/save_post/" + postID,
-            method: "POST",
-
-            // When AJAX request is a success:
-            success: function(data) {
-
-                if (data.redirect) {
-                    window.location.href = data.redirect;  // Redirect to the URL sent by the server which would be the login page if the user_id is None.
-                }
-
-                // If we save the post into the gallery then change the icon color
-                if (data.saved) {
-                    button.css("background-color", "#fdd68f")
-                } 
-                
-                else {
-                    button.css("background-color", "#FFA500")
-                }
-            },
-
-            error: function(err) {
-                console.log('Error saving post:', err);
-            }
+        var postID = button.data('post-id');
+
+        serverState(button, "saved");
+        showSaved(button, !(button.data("saved") === true));
+        sendLater("save:" + postID, function () {
+            sendSave(button);
         });
-    }); 
+    });
+
 
+    watchCards(document);
 
-    // Load saved posts when the page loads
-    loadSavedPosts();
+    // If the user comes back to the page with the back button, the browser shows a cached copy so we refresh the like and save states
+    // and open the like count stream again
+    $(window).on("pageshow", function (event) {
+        if (event.originalEvent.persisted) {
+            loadPostStates(document);
+            subscribedIDs = "";
+            subscribeLikes();
+        }
+    });
 
-    // Load liked posts when the page loads
-    loadLikedPosts();
+    // The stream is closed when the user leaves the page, so the browser can keep the page in its cache
+    $(window).on("pagehide", function () {
+        if (likeEvents) {
+            likeEvents.close();
+            likeEvents = null;
+        }
+    });
 
-    // Load the likes number per each post: 
-    loadLikeCounts()
+    // Fetch the next page when the user gets close to the end of the feed
+    $(window).on("scroll", function () {
+        if ($(window).scrollTop() + $(window).height() > $(document).height() - 600) {
+            loadNextPage();
+        }
+    });
 });
\ No newline at end of file
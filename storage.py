@@ -0,0 +1,87 @@
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from urllib.parse import urlparse
+import os
+
+from db import get_s3
+from jobs import BatchQueue
+
+# AWS S3 Bucket access. The client is created by db.get_s3(); S3_ENDPOINT_URL points it at an S3 compatible stand-in (e.g. `moto_server`)
+# for local development and testing.
+
+# The largest image a user can upload (in bytes)
+MAX_UPLOAD_SIZE = 16 * 1024 * 1024
+
+# How long a browser has to use an upload URL (in seconds)
+UPLOAD_URL_EXPIRATION = 300
+
+ALLOWED_IMAGE_TYPES = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif', 'image/webp': 'webp'}
+
+# Uploads are sent in 8MB parts, so only one part of a large file is held in memory at a time
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024)
+
+def bucket_name():
+    return os.getenv('BUCKET_NAME')
+
+# The public URL of an object in the bucket
+def public_url(key):
+    if os.getenv('S3_ENDPOINT_URL'):
+        return f"{os.getenv('S3_ENDPOINT_URL').rstrip('/')}/{bucket_name()}/{key}"
+    return f"https://{bucket_name()}.s3.amazonaws.com/{key}"
+
+# Whether a URL points to an object in the bucket (the default avatar, for example, is hosted elsewhere)
+def is_bucket_url(url):
+    return bool(url) and url.startswith(public_url(''))
+
+# The key of an object from its public URL
+def key_from_url(url):
+    key = urlparse(url).path.lstrip('/')
+    if os.getenv('S3_ENDPOINT_URL') and key.startswith(f"{bucket_name()}/"):
+        key = key[len(bucket_name()) + 1:]
+    return key
+
+# Returns a presigned POST (a URL and the form fields to send with the file) which lets the browser upload one image straight to the bucket.
+# S3 itself enforces the key, the content type and the size limit, so the image never goes through the Flask worker.
+def presigned_upload(key, content_type):
+    return get_s3().generate_presigned_post(
+        Bucket=bucket_name(),
+        Key=key,
+        Fields={'Content-Type': content_type},
+        Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, MAX_UPLOAD_SIZE]],
+        ExpiresIn=UPLOAD_URL_EXPIRATION
+    )
+
+# Returns the metadata of an uploaded object, or None if nothing was uploaded under this key
+def uploaded_object(key):
+    try:
+        return get_s3().head_object(Bucket=bucket_name(), Key=key)
+    except ClientError:
+        return None
+
+# Streams a file object to the bucket in parts instead of reading it into memory first
+def upload_stream(fileobj, key, content_type):
+    get_s3().upload_fileobj(fileobj, bucket_name(), key, ExtraArgs={'ContentType': content_type}, Config=TRANSFER_CONFIG)
+
+# Streams an object from the bucket into a file object
+def download_stream(key, fileobj):
+    get_s3().download_fileobj(bucket_name(), key, fileobj, Config=TRANSFER_CONFIG)
+
+def put_object(key, body, content_type, cache_control=None):
+    extra = {'CacheControl': cache_control} if cache_control else {}
+    get_s3().put_object(Bucket=bucket_name(), Key=key, Body=body, ContentType=content_type, **extra)
+
+def delete_object(key):
+    get_s3().delete_object(Bucket=bucket_name(), Key=key)
+
+# Deletes up to 1000 objects with a single request. Returns the keys which could not be deleted.
+def delete_objects(keys):
+    response = get_s3().delete_objects(Bucket=bucket_name(), Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True})
+    return [error['Key'] for error in response.get('Errors', [])]
+
+# Objects deleted by the routes are removed in the background, batched into delete_objects requests
+deletions = BatchQueue(delete_objects, max_size=1000)
+
+def delete_later(*keys):
+    for key in keys:
+        if key:
+            deletions.put(key)
@@ -0,0 +1,79 @@
+# Shared fixtures of the tests. MongoDB is mongomock and S3 is moto, so the tests run offline:
+#
+#   pip install -r requirements-dev.txt
+#   python -m pytest
+import os
+import sys
+
+# Settings the modules read when they are imported
+os.environ.setdefault('MONGO_DBNAME', 'artroam_test')
+os.environ.setdefault('BUCKET_NAME', 'artroam-test-bucket')
+os.environ.setdefault('APP_SECRET_KEY', 'test-secret')
+os.environ.setdefault('SESSION_BACKEND', 'cookie')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import mongomock
+import pytest
+from moto import mock_aws
+
+import db
+import ratelimit
+from cache import cache, LRUCache
+
+# A fresh mongomock database for every test, with the app's indexes (the unique (user_id, post_id) indexes decide likes and saves).
+# The in-process cache and the rate limits are emptied too, so no test sees what an earlier one did.
+@pytest.fixture
+def database(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(db, 'create_mongo_client', lambda: client)
+    db.clients.pop('mongo', None)
+    monkeypatch.setattr(cache, 'local', LRUCache())
+    for limiter in (ratelimit.user_limiter, ratelimit.ip_limiter, ratelimit.post_limiter):
+        limiter.buckets.clear()
+
+    from indexes import ensure_indexes
+    database = db.get_database()
+    ensure_indexes(database)
+    yield database
+    db.clients.pop('mongo', None)
+
+# mongomock can't run update pipelines with $toLong, so the like and save counters are updated with a plain $inc. The pipeline itself
+# (the counter and the trending score it recomputes) is checked against trending_score() in test_trending.py.
+@pytest.fixture
+def counters(monkeypatch):
+    import utils
+    monkeypatch.setattr(utils, 'counter_update', lambda field, delta: {'$inc': {field: delta}})
+
+# The bucket, in moto
+@pytest.fixture
+def bucket():
+    with mock_aws():
+        db.clients.pop('s3', None)
+        db.get_s3().create_bucket(Bucket=os.getenv('BUCKET_NAME'))
+        yield os.getenv('BUCKET_NAME')
+        db.clients.pop('s3', None)
+
+@pytest.fixture
+def app(database):
+    from app import app
+    app.config['TESTING'] = True
+    return app
+
+# A test client logged in as a new user
+@pytest.fixture
+def client(app, database):
+    user_id = str(database.users.insert_one({'username': 'tester', 'email': 'tester@example.com'}).inserted_id)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    client.user_id = user_id
+    return client
+
+@pytest.fixture
+def post_id(database):
+    import datetime
+    return str(database.posts.insert_one({'user_id': 'author', 'username': 'author', 'post_title': 'A post', 'likes': 0, 'saves': 0,
+                                          'created_at': datetime.datetime.utcnow()}).inserted_id)
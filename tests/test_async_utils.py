@@ -0,0 +1,20 @@
+import asyncio
+import threading
+
+import async_utils
+from cache import cache, RedisCache
+
+def caller_thread():
+    return threading.current_thread()
+
+def test_cache_calls_leave_the_event_loop_only_for_the_shared_tier(monkeypatch):
+    async def call():
+        return threading.current_thread(), await async_utils.call_cache(caller_thread)
+
+    loop_thread, called_on = asyncio.run(call())
+    assert called_on is loop_thread
+
+    # With Redis configured the call blocks on the network, so it runs in a thread
+    monkeypatch.setattr(cache, 'shared', RedisCache(client=None))
+    loop_thread, called_on = asyncio.run(call())
+    assert called_on is not loop_thread
@@ -0,0 +1,71 @@
+import pytest
+
+import cache as cache_module
+from cache import Cache, LRUCache, RedisCache, feed_key, likes_key, set_like_count, apply_like_counts, record_interaction
+from models import PostCard
+
+# The part of a Redis client the shared tier uses. Like Redis it stores bytes: INCR keeps the counter as its decimal digits.
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def incr(self, key):
+        value = int(self.values.get(key, b'0')) + 1
+        self.values[key] = str(value).encode()
+        return value
+
+# Two app processes: each has its own local tier, they share one Redis
+@pytest.fixture
+def processes():
+    redis = FakeRedis()
+    return Cache(LRUCache(), RedisCache(redis)), Cache(LRUCache(), RedisCache(redis))
+
+def test_versions_are_shared(processes, monkeypatch):
+    first, second = processes
+    assert second.version('feed') == 0
+    first.bump_version('feed')
+    first.bump_version('feed')
+    assert second.version('feed') == 2
+    assert second.modified('feed') == first.modified('feed') is not None
+
+    # The keys and validators of the routes read the versions
+    monkeypatch.setattr(cache_module, 'cache', second)
+    assert feed_key(None, None, None).startswith('feed:2:')
+    record_interaction('alice')
+    assert first.version('counts') == 1
+
+def test_values_are_shared(processes):
+    first, second = processes
+    first.set('user:alice', {'username': 'alice'}, 60)
+    assert second.get('user:alice') == {'username': 'alice'}
+    first.delete('user:alice')
+    assert first.get('user:alice') is None
+
+def test_like_counts_of_other_processes_reach_cached_pages(processes, monkeypatch):
+    first, second = processes
+    monkeypatch.setattr(cache_module, 'cache', first)
+    set_like_count('post-1', 7)
+
+    monkeypatch.setattr(cache_module, 'cache', second)
+    posts = apply_like_counts([PostCard(_id='post-1', likes=3), PostCard(_id='post-2', likes=5)])
+    assert [post.likes for post in posts] == [7, 5]
+    # Now in the second process's local tier too
+    assert second.local.get(likes_key('post-1')) == 7
+
+def test_versions_without_the_shared_tier():
+    local = Cache(LRUCache())
+    assert local.version('feed') == 0
+    local.bump_version('feed')
+    assert local.version('feed') == 1
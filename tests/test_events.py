@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+from events import AsyncSubscription, LikeBroker, subscribed_post_ids, MAX_SUBSCRIBED_POSTS
+
+def test_counts_published_from_other_threads_wake_the_stream():
+    async def follow():
+        broker = LikeBroker()
+        subscription = broker.subscribe(AsyncSubscription(['a', 'b']))
+
+        # Published while nobody waits: merged, the latest count of each post is sent once
+        def publish():
+            for likes in (1, 2, 3):
+                broker.publish('a', likes)
+            broker.publish('c', 9)
+        thread = threading.Thread(target=publish)
+        thread.start()
+        thread.join()
+        assert await subscription.wait(1) == {'a': 3}
+
+        # Nothing published: the wait times out (and the stream sends a keep-alive)
+        assert await subscription.wait(0.01) == {}
+
+        broker.unsubscribe(subscription)
+        assert broker.stats() == {'posts': 0, 'subscriptions': 0}
+
+    asyncio.run(follow())
+
+def test_subscribed_post_ids():
+    assert subscribed_post_ids('a,,b') == ['a', 'b']
+    assert subscribed_post_ids(None) == []
+    assert len(subscribed_post_ids(','.join(map(str, range(500))))) == MAX_SUBSCRIBED_POSTS
@@ -0,0 +1,81 @@
+import datetime
+
+from flask import Flask, session
+
+from cache import cache
+from httpcache import conditional, not_modified, validators
+
+def test_not_modified():
+    last_modified = datetime.datetime(2024, 1, 1, 12, 0, 0, 500000, tzinfo=datetime.timezone.utc)
+    etag = 'W/"abc"'
+    assert not_modified('W/"abc"', None, etag, last_modified)
+    assert not_modified('"abc"', None, etag, last_modified)
+    assert not_modified('"other", W/"abc"', None, etag, last_modified)
+    assert not not_modified('"other"', None, etag, last_modified)
+    # If-Modified-Since is only looked at without If-None-Match
+    assert not_modified(None, 'Mon, 01 Jan 2024 12:00:00 GMT', etag, last_modified)
+    assert not not_modified(None, 'Mon, 01 Jan 2024 11:59:59 GMT', etag, last_modified)
+    assert not not_modified('"other"', 'Mon, 01 Jan 2024 12:00:00 GMT', etag, last_modified)
+    assert not not_modified(None, 'Mon, 01 Jan 2024 12:00:00 GMT', etag, None)
+
+def test_validators_change_with_the_versions(database):
+    etag, last_modified = validators('/page', ['feed'])
+    assert validators('/page', ['feed']) == (etag, last_modified)
+    assert validators('/other', ['feed'])[0] != etag
+    # Responses which depend on the session have no Last-Modified time
+    assert validators('/page', ['feed'], 'alice')[1] is None
+
+    cache.bump_version('feed')
+    assert validators('/page', ['feed'])[0] != etag
+
+def conditional_app():
+    app = Flask(__name__)
+    app.secret_key = 'test-secret'
+    app.calls = 0
+
+    @app.route('/feed')
+    @conditional('feed')
+    def feed():
+        app.calls += 1
+        return 'feed'
+
+    @app.route('/login')
+    def login():
+        session['user_id'] = 'alice'
+        return ''
+
+    return app
+
+def test_conditional_answers_304_while_the_versions_are_unchanged(database):
+    app = conditional_app()
+    client = app.test_client()
+
+    response = client.get('/feed')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'public, no-cache'
+    assert response.headers['Last-Modified']
+    etag = response.headers['ETag']
+
+    response = client.get('/feed', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert app.calls == 1
+
+    cache.bump_version('feed')
+    response = client.get('/feed', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert app.calls == 2
+
+def test_conditional_responses_of_a_session_are_private(database):
+    app = conditional_app()
+    client = app.test_client()
+    anonymous = client.get('/feed').headers['ETag']
+
+    client.get('/login')
+    response = client.get('/feed')
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    assert response.headers['Vary'] == 'Cookie'
+    assert 'Last-Modified' not in response.headers
+    assert response.headers['ETag'] != anonymous
+    assert client.get('/feed', headers={'If-None-Match': anonymous}).status_code == 200
@@ -0,0 +1,39 @@
+from bson.objectid import ObjectId
+import pytest
+
+from utils import toggle_like, set_like
+
+pytestmark = pytest.mark.usefixtures('counters')
+
+def likes(database, post_id):
+    return database.posts.find_one({'_id': ObjectId(post_id)})['likes']
+
+def test_toggle_like_likes_then_unlikes(database, post_id):
+    assert toggle_like(post_id, 'alice') == (1, True)
+    assert toggle_like(post_id, 'bob') == (2, True)
+    assert toggle_like(post_id, 'alice') == (1, False)
+    assert likes(database, post_id) == 1
+    assert database.likes.count_documents({'post_id': ObjectId(post_id)}) == 1
+
+def test_set_like_is_idempotent(database, post_id):
+    assert set_like(post_id, 'alice', True) == (1, True)
+    assert set_like(post_id, 'alice', True) == (1, True)
+    assert likes(database, post_id) == 1
+    assert set_like(post_id, 'alice', False) == (0, False)
+    assert set_like(post_id, 'alice', False) == (0, False)
+    assert likes(database, post_id) == 0
+    assert database.likes.count_documents({}) == 0
+
+def test_liking_a_missing_post(database):
+    missing = str(ObjectId())
+    assert toggle_like(missing, 'alice') is None
+    assert set_like(missing, 'alice', True) is None
+    assert database.likes.count_documents({}) == 0
+
+def test_like_endpoint_toggles_or_sets_the_state(client, post_id):
+    assert client.post(f"/like_post/{post_id}").get_json() == {'likes': 1, 'liked': True}
+    assert client.post(f"/like_post/{post_id}?liked=true").get_json() == {'likes': 1, 'liked': True}
+    assert client.post(f"/like_post/{post_id}").get_json() == {'likes': 0, 'liked': False}
+
+def test_like_endpoint_needs_a_login(app, post_id):
+    assert app.test_client().post(f"/like_post/{post_id}").get_json() == {'redirect': '/login'}
@@ -0,0 +1,52 @@
+import datetime
+
+from bson.objectid import ObjectId
+
+from utils import encode_cursor, decode_cursor, cursor_filter, paginate
+
+def test_datetime_cursor_round_trips():
+    doc_id = ObjectId()
+    created_at = datetime.datetime(2024, 5, 17, 12, 30, 45, 123000)
+    assert decode_cursor(encode_cursor(created_at, doc_id)) == (created_at, doc_id)
+
+def test_number_cursor_round_trips():
+    doc_id = ObjectId()
+    assert decode_cursor(encode_cursor(12.375, doc_id)) == (12.375, doc_id)
+    assert decode_cursor(encode_cursor(None, doc_id)) == (0.0, doc_id)
+
+def test_malformed_cursors_are_ignored():
+    for cursor in (None, '', 'garbage', 'x123_' + str(ObjectId()), 'd12_not-an-id', 'dabc_' + str(ObjectId())):
+        assert decode_cursor(cursor) is None
+        assert cursor_filter(cursor) == {}
+
+def test_paginate_returns_every_document_once_in_order(database):
+    start = datetime.datetime(2024, 1, 1)
+    # Several documents share a created_at, so the _id has to break the ties
+    database.posts.insert_many([{'created_at': start + datetime.timedelta(seconds=i // 3), 'score': float(i % 4)} for i in range(29)])
+
+    for field in ('created_at', 'score'):
+        expected = [doc['_id'] for doc in database.posts.find().sort([(field, -1), ('_id', -1)])]
+        seen, cursor = [], None
+        while True:
+            docs, cursor = paginate(database.posts, {}, cursor, limit=5, field=field)
+            assert len(docs) <= 5
+            seen.extend(doc['_id'] for doc in docs)
+            if cursor is None:
+                break
+        assert seen == expected
+
+def test_cursors_of_the_other_sort_order_start_from_the_first_page():
+    date_cursor = encode_cursor(datetime.datetime(2024, 1, 1), ObjectId())
+    number_cursor = encode_cursor(3.5, ObjectId())
+    assert cursor_filter(date_cursor, 'score') == {}
+    assert cursor_filter(number_cursor, 'created_at') == {}
+    assert cursor_filter(number_cursor, 'score')
+    assert cursor_filter(date_cursor, 'created_at')
+
+def test_trending_feed_with_a_date_cursor(client, database):
+    database.posts.insert_many([{'user_id': 'author', 'username': 'author', 'post_title': f"Post {i}", 'likes': 0, 'saves': 0,
+                                 'created_at': datetime.datetime(2024, 1, 1), 'score': float(i)} for i in range(3)])
+    cursor = encode_cursor(datetime.datetime(2024, 1, 2), ObjectId())
+    response = client.get(f"/feed?sort=trending&cursor={cursor}")
+    assert response.status_code == 200
+    assert all(f"Post {i}" in response.text for i in range(3))
@@ -0,0 +1,30 @@
+from bson.objectid import ObjectId
+import pytest
+
+from utils import toggle_like, toggle_save, get_liked_post_ids, get_saved_post_ids, get_post_states
+
+pytestmark = pytest.mark.usefixtures('counters')
+
+def test_membership_lookups_answer_for_a_whole_page(database, post_id):
+    other = str(database.posts.insert_one({'post_title': 'Another post', 'likes': 0, 'saves': 0}).inserted_id)
+    toggle_like(post_id, 'alice')
+    toggle_save('alice', other)
+
+    page = [ObjectId(post_id), ObjectId(other), ObjectId()]
+    assert get_liked_post_ids('alice', page) == {post_id}
+    assert get_saved_post_ids('alice', page) == {other}
+    assert get_liked_post_ids('bob', page) == set()
+
+def test_post_states(database, post_id):
+    toggle_like(post_id, 'alice')
+    toggle_save('alice', post_id)
+
+    assert get_post_states([post_id, 'not-an-id'], 'alice') == {post_id: {'likes': 1, 'liked': True, 'saved': True}}
+    assert get_post_states([post_id], 'bob') == {post_id: {'likes': 1, 'liked': False, 'saved': False}}
+    assert get_post_states([post_id]) == {post_id: {'likes': 1, 'liked': False, 'saved': False}}
+    assert get_post_states([]) == {}
+
+def test_post_states_endpoint(client, post_id):
+    client.post(f"/like_post/{post_id}")
+    assert client.get(f"/post_states?ids={post_id},{ObjectId()}").get_json() == {
+        'states': {post_id: {'likes': 1, 'liked': True, 'saved': False}}}
@@ -0,0 +1,37 @@
+import pytest
+
+from ratelimit import TokenBucket, RateLimiter, interaction_retry_after, POST_BURST
+
+def test_token_bucket_allows_a_burst_then_refills():
+    bucket = TokenBucket(rate=2, burst=3)
+    now = bucket.updated_at
+    assert [bucket.take(now) for _ in range(3)] == [0, 0, 0]
+    # Empty: the next token comes back after 1 / rate seconds
+    assert bucket.take(now) == pytest.approx(0.5)
+    assert bucket.take(now + 0.25) == pytest.approx(0.25)
+    assert bucket.take(now + 0.5) == 0
+    # Never saves up more than the burst
+    assert [bucket.take(now + 100) for _ in range(4)][-1] > 0
+
+def test_rate_limiter_keeps_one_bucket_per_key():
+    limiter = RateLimiter(rate=1, burst=1, max_keys=2)
+    assert limiter.check('a') == 0
+    assert limiter.check('a') > 0
+    assert limiter.check('b') == 0
+    assert limiter.limited == 1
+
+    # Only the most recently used max_keys buckets are kept
+    limiter.check('c')
+    assert list(limiter.buckets) == ['b', 'c']
+
+def test_each_button_of_a_user_has_its_own_limit(database):
+    assert all(interaction_retry_after('alice', '10.0.0.1', 'like:1') == 0 for _ in range(POST_BURST))
+    assert interaction_retry_after('alice', '10.0.0.1', 'like:1') > 0
+    assert interaction_retry_after('alice', '10.0.0.1', 'save:1') == 0
+    assert interaction_retry_after('bob', '10.0.0.1', 'like:1') == 0
+
+def test_limited_requests_get_a_429(client, post_id, counters):
+    responses = [client.post(f"/like_post/{post_id}?liked=true") for _ in range(POST_BURST + 1)]
+    assert [response.status_code for response in responses[:-1]] == [200] * POST_BURST
+    assert responses[-1].status_code == 429
+    assert int(responses[-1].headers['Retry-After']) >= 1
@@ -0,0 +1,52 @@
+from bson.objectid import ObjectId
+import datetime
+import pytest
+
+from utils import toggle_save, set_save, get_saved_post_ids, gallery_page
+
+pytestmark = pytest.mark.usefixtures('counters')
+
+def saves(database, post_id):
+    return database.posts.find_one({'_id': ObjectId(post_id)})['saves']
+
+def test_toggle_save_saves_then_unsaves(database, post_id):
+    assert toggle_save('alice', post_id) is True
+    assert get_saved_post_ids('alice', [ObjectId(post_id)]) == {post_id}
+    assert saves(database, post_id) == 1
+    assert toggle_save('alice', post_id) is False
+    assert get_saved_post_ids('alice', [ObjectId(post_id)]) == set()
+    assert saves(database, post_id) == 0
+
+def test_set_save_is_idempotent(database, post_id):
+    assert set_save('alice', post_id, True) is True
+    assert set_save('alice', post_id, True) is True
+    assert database.saves.count_documents({'user_id': 'alice'}) == 1
+    assert saves(database, post_id) == 1
+    assert set_save('alice', post_id, False) is False
+    assert set_save('alice', post_id, False) is False
+    assert saves(database, post_id) == 0
+
+def test_saving_a_missing_post(database):
+    assert set_save('alice', str(ObjectId()), True) is False
+    assert database.saves.count_documents({}) == 0
+
+def test_gallery_lists_the_most_recently_saved_posts_first(database):
+    now = datetime.datetime.utcnow()
+    post_ids = [str(database.posts.insert_one({'user_id': 'author', 'username': 'author', 'post_title': f"Post {i}", 'likes': 0,
+                                               'saves': 0, 'created_at': now}).inserted_id) for i in range(5)]
+    for post_id in post_ids:
+        toggle_save('alice', post_id)
+    # Saves of deleted posts are left out
+    database.posts.delete_one({'_id': ObjectId(post_ids[2])})
+
+    cards, cursor = gallery_page('alice', limit=2)
+    seen = [card._id for card in cards]
+    while cursor:
+        cards, cursor = gallery_page('alice', cursor, limit=2)
+        seen.extend(card._id for card in cards)
+    assert [str(post_id) for post_id in seen] == [post_ids[4], post_ids[3], post_ids[1], post_ids[0]]
+
+def test_save_endpoint_toggles_or_sets_the_state(client, post_id):
+    assert client.post(f"/save_post/{post_id}?saved=true").get_json() == {'saved': True}
+    assert client.post(f"/save_post/{post_id}?saved=true").get_json() == {'saved': True}
+    assert client.post(f"/save_post/{post_id}").get_json() == {'saved': False}
@@ -0,0 +1,77 @@
+import datetime
+
+from flask import Flask, session
+import pytest
+
+from sessions import init_session, MongoSessionInterface
+
+@pytest.fixture
+def session_app(database):
+    app = Flask(__name__)
+    app.secret_key = 'test-secret'
+    app.permanent_session_lifetime = datetime.timedelta(days=7)
+    init_session(app, database, 'mongodb')
+
+    @app.route('/login')
+    def login():
+        session['user_id'] = 'alice'
+        return ''
+
+    @app.route('/whoami')
+    def whoami():
+        return session.get('user_id') or ''
+
+    @app.route('/logout')
+    def logout():
+        session.clear()
+        return ''
+
+    return app
+
+def session_cookie(response):
+    return next((header for header in response.headers.getlist('Set-Cookie') if header.startswith('session=')), None)
+
+def test_sessions_are_permanent_by_default(session_app, database):
+    client = session_app.test_client()
+    cookie = session_cookie(client.get('/login'))
+    assert 'Expires=' in cookie
+    assert client.get('/whoami').text == 'alice'
+    assert database.sessions.count_documents({}) == 1
+
+def test_session_permanent_false_gives_a_browser_session_cookie(session_app):
+    session_app.config['SESSION_PERMANENT'] = False
+    client = session_app.test_client()
+    cookie = session_cookie(client.get('/login'))
+    assert cookie and 'Expires=' not in cookie
+    assert client.get('/whoami').text == 'alice'
+
+def test_unchanged_sessions_are_only_written_once_they_get_old(session_app, database):
+    client = session_app.test_client()
+    client.get('/login')
+    expires_at = database.sessions.find_one()['expires_at']
+
+    # Recently written: reading the session writes nothing
+    response = client.get('/whoami')
+    assert session_cookie(response) is None
+    assert database.sessions.find_one()['expires_at'] == expires_at
+
+    # Last written longer than REFRESH_AFTER ago: the expiry and the cookie move forward
+    stale = expires_at - MongoSessionInterface.REFRESH_AFTER - datetime.timedelta(minutes=1)
+    database.sessions.update_one({}, {'$set': {'expires_at': stale}})
+    response = client.get('/whoami')
+    assert response.text == 'alice'
+    assert 'Expires=' in session_cookie(response)
+    assert database.sessions.find_one()['expires_at'] > expires_at - datetime.timedelta(minutes=1)
+
+def test_expired_sessions_are_not_loaded(session_app, database):
+    client = session_app.test_client()
+    client.get('/login')
+    database.sessions.update_one({}, {'$set': {'expires_at': datetime.datetime.utcnow() - datetime.timedelta(seconds=1)}})
+    assert client.get('/whoami').text == ''
+
+def test_logout_removes_the_session(session_app, database):
+    client = session_app.test_client()
+    client.get('/login')
+    client.get('/logout')
+    assert database.sessions.count_documents({}) == 0
+    assert client.get('/whoami').text == ''
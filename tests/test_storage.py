@@ -0,0 +1,50 @@
+import requests
+
+import storage
+
+def upload(presigned, body=b'image bytes'):
+    return requests.post(presigned['url'], data=presigned['fields'], files={'file': ('image.png', body)})
+
+def test_presigned_upload_puts_the_object_under_its_key(bucket):
+    presigned = storage.presigned_upload('uploads/image.png', 'image/png')
+    assert presigned['fields']['key'] == 'uploads/image.png'
+    assert presigned['fields']['Content-Type'] == 'image/png'
+
+    assert storage.uploaded_object('uploads/image.png') is None
+    assert upload(presigned).status_code in (200, 204)
+    assert storage.uploaded_object('uploads/image.png')['ContentLength'] == len(b'image bytes')
+
+def test_upload_url_only_accepts_images(client, bucket):
+    response = client.post('/upload_url', json={'content_type': 'text/html'})
+    assert response.status_code == 400
+
+    response = client.post('/upload_url', json={'content_type': 'image/webp'})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['key'].endswith('.webp')
+    assert data['upload']['fields']['key'] == data['key']
+    with client.session_transaction() as session:
+        assert session['pending_upload_key'] == data['key']
+
+def test_upload_url_needs_a_login(app, bucket):
+    assert app.test_client().post('/upload_url', json={'content_type': 'image/png'}).get_json() == {'redirect': '/login'}
+
+def test_create_only_accepts_the_key_of_this_session_once_uploaded(client, bucket):
+    data = client.post('/upload_url', json={'content_type': 'image/png'}).get_json()
+
+    # Not uploaded yet
+    assert client.post('/create', json={'key': data['key']}).status_code == 400
+    # Uploaded, but not the key this session was given
+    storage.put_object('someone-elses.png', b'image bytes', 'image/png')
+    assert client.post('/create', json={'key': 'someone-elses.png'}).status_code == 400
+
+    upload(data['upload'])
+    response = client.post('/create', json={'key': data['key']})
+    assert response.status_code == 200
+    assert response.get_json() == {'redirect': '/post'}
+    with client.session_transaction() as session:
+        assert session['uploaded_file_key'] == data['key']
+        assert 'pending_upload_key' not in session
+
+    # The key can't be used a second time
+    assert client.post('/create', json={'key': data['key']}).status_code == 400
@@ -0,0 +1,83 @@
+import datetime
+import math
+
+import pytest
+
+from utils import EPOCH, SCORE_EXPRESSION, counter_update, trending_score
+
+# mongomock can't convert dates with $toLong, so the expressions the app sends to Mongo are evaluated here, with the semantics of
+# the operators they use
+def evaluate(expression, document):
+    if isinstance(expression, str) and expression.startswith('$'):
+        return document.get(expression[1:])
+    if not isinstance(expression, dict):
+        return expression
+
+    (operator, arguments), = expression.items()
+    values = [evaluate(argument, document) for argument in (arguments if isinstance(arguments, list) else [arguments])]
+    if operator == '$add':
+        return sum(values)
+    if operator == '$multiply':
+        return math.prod(values)
+    if operator == '$divide':
+        return values[0] / values[1]
+    if operator == '$max':
+        return max(values)
+    if operator == '$log10':
+        return math.log10(values[0])
+    if operator == '$ifNull':
+        return values[1] if values[0] is None else values[0]
+    if operator == '$toLong':
+        # Dates become milliseconds since the epoch
+        return (values[0] - EPOCH) // datetime.timedelta(milliseconds=1)
+    raise NotImplementedError(operator)
+
+# Runs an update pipeline ($set stages) on a document
+def update(pipeline, document):
+    document = dict(document)
+    for stage in pipeline:
+        (operator, fields), = stage.items()
+        assert operator == '$set'
+        document.update({field: evaluate(expression, document) for field, expression in fields.items()})
+    return document
+
+POSTS = [
+    {'likes': 0, 'saves': 0, 'created_at': datetime.datetime(2024, 1, 1)},
+    {'likes': 1, 'saves': 0, 'created_at': datetime.datetime(2024, 1, 1, 12, 30, 0, 250000)},
+    {'likes': 120, 'saves': 7, 'created_at': datetime.datetime(2025, 6, 30, 23, 59, 59)},
+    {'created_at': datetime.datetime(2023, 3, 5, 8)},
+]
+
+@pytest.mark.parametrize('post', POSTS)
+def test_score_expression_matches_trending_score(post):
+    assert evaluate(SCORE_EXPRESSION, post) == pytest.approx(trending_score(post.get('likes'), post.get('saves'), post['created_at']), abs=1e-9)
+
+@pytest.mark.parametrize('post', POSTS)
+@pytest.mark.parametrize('field, delta', [('likes', 1), ('likes', -1), ('saves', 1), ('saves', -1)])
+def test_counter_update_recomputes_the_score(post, field, delta):
+    updated = update(counter_update(field, delta), post)
+    assert updated[field] == (post.get(field) or 0) + delta
+    assert updated['score'] == pytest.approx(trending_score(updated.get('likes'), updated.get('saves'), post['created_at']), abs=1e-9)
+
+def test_more_engagement_ranks_higher_and_newer_posts_rank_higher():
+    created_at = datetime.datetime(2024, 1, 1)
+    assert trending_score(10, 0, created_at) > trending_score(9, 0, created_at)
+    assert trending_score(0, 1, created_at) == trending_score(2, 0, created_at)
+    # 10 times the likes make up for being SCORE_TIME_UNIT seconds older
+    assert trending_score(100, 0, created_at) == pytest.approx(trending_score(10, 0, created_at + datetime.timedelta(hours=12.5)))
+
+def test_refresh_scores_repairs_the_saves_counters(database, monkeypatch):
+    import utils
+    # The score itself is checked above, mongomock only has to run a pipeline it supports
+    monkeypatch.setattr(utils, 'SCORE_EXPRESSION', {'$add': [{'$ifNull': ['$likes', 0]}, {'$multiply': [utils.SAVE_WEIGHT, '$saves']}]})
+    created_at = datetime.datetime(2024, 1, 1)
+    saved, unsaved, missing = database.posts.insert_many([{'likes': 1, 'saves': 0, 'created_at': created_at},
+                                                         {'likes': 2, 'saves': 4, 'created_at': created_at},
+                                                         {'likes': 3, 'created_at': created_at}]).inserted_ids
+    database.saves.insert_many([{'user_id': user_id, 'post_id': saved, 'created_at': created_at} for user_id in ('alice', 'bob')])
+
+    utils.refresh_scores(batch_size=1)
+    posts = {post['_id']: post for post in database.posts.find()}
+    assert (posts[saved]['saves'], posts[saved]['score']) == (2, 5)
+    assert (posts[unsaved]['saves'], posts[unsaved]['score']) == (0, 2)
+    assert (posts[missing]['saves'], posts[missing]['score']) == (0, 3)
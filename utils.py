@@ -1,25 +1,363 @@
-from pymongo import MongoClient
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from bson.objectid import ObjectId   
-import os
+from bson.errors import InvalidId
+import datetime
+import math
 
-client = MongoClient(os.getenv('MONGO_URI'))
-database = client[os.getenv('MONGO_DBNAME')]
+from db import database
+from events import publish_like_count
+from models import CARD_FIELDS, post_cards
+from cache import cache, user_key, USER_TTL, invalidate_feeds, record_interaction
 
-# get user by id from MongoDB
+
+# The number of posts that every listing route (explore, search, filter, profiles) returns per page
+PAGE_SIZE = 12
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# get user by id from MongoDB (through the cache, the password hash is never loaded)
 def get_user_by_id(user_id):
-    return database['users'].find_one({'_id': ObjectId(user_id)})
+    return cache.get_or_load(user_key(user_id), lambda: database['users'].find_one({'_id': ObjectId(user_id)}, {'password': 0}), USER_TTL)
 
-def unlike_post_by_id(post_id):
-    post = database['posts'].find_one({'_id': ObjectId(post_id)})
-    if post:
-        current_likes = post['likes']
-        if current_likes > 0:
-            database['posts'].update_one({'_id': ObjectId(post_id)}, {'$set': {'likes': current_likes - 1}})
+# Trending score of the explore page: log10(likes + 2 * saves) plus the time the post was created, in units of 12.5 hours.
+# A post created 12.5 hours later needs 10 times the likes to rank the same, so older posts sink without their scores ever having to be
+# recomputed: the score only changes when a post is liked or saved, and is updated in the same write (see counter_update).
+SAVE_WEIGHT = 2
+SCORE_TIME_UNIT = 45000
+
+def trending_score(likes, saves, created_at):
+    engagement = max((likes or 0) + SAVE_WEIGHT * (saves or 0), 1)
+    return math.log10(engagement) + (created_at - EPOCH).total_seconds() / SCORE_TIME_UNIT
+
+# The same score, computed by Mongo from the post's own fields
+SCORE_EXPRESSION = {'$add': [
+    {'$log10': {'$max': [{'$add': [{'$ifNull': ['$likes', 0]}, {'$multiply': [SAVE_WEIGHT, {'$ifNull': ['$saves', 0]}]}]}, 1]}},
+    {'$divide': [{'$toLong': '$created_at'}, SCORE_TIME_UNIT * 1000]}
+]}
+
+# Update pipeline which adds delta to a counter of the post (likes or saves) and recomputes its trending score in the same write
+def counter_update(field, delta):
+    return [{'$set': {field: {'$add': [{'$ifNull': [f"${field}", 0]}, delta]}}}, {'$set': {'score': SCORE_EXPRESSION}}]
+
+# Recomputes the saves counter and trending score of every post (for posts created before trending existed, or to repair the counters).
+# Counters are reset first, so posts whose saves are all gone end up with 0 instead of keeping a stale count.
+def refresh_scores(batch_size=500):
+    database['posts'].update_many({'saves': {'$ne': 0}}, {'$set': {'saves': 0}})
+    batch = []
+    for count in database['saves'].aggregate([{'$group': {'_id': '$post_id', 'saves': {'$sum': 1}}}]):
+        batch.append(UpdateOne({'_id': count['_id']}, {'$set': {'saves': count['saves']}}))
+        if len(batch) == batch_size:
+            database['posts'].bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        database['posts'].bulk_write(batch, ordered=False)
+
+    database['posts'].update_many({}, [{'$set': {'score': SCORE_EXPRESSION}}])
+    invalidate_feeds()
+
+# The posts a user saved to their gallery are documents {user_id, post_id, created_at} in the `saves` collection, with a unique index on
+# (user_id, post_id), the same way as likes. The user document doesn't grow with every save, and the gallery is read in the order the
+# posts were saved straight from the (user_id, created_at) index.
+# Saving inserts the save (which fails if the post is already saved) and then updates the post's saves counter and trending score.
+# Returns the post's saves counter, or None if the post was already saved (or doesn't exist).
+def save_post_by_id(post_id, user_id):
+    try:
+        database['saves'].insert_one({'user_id': user_id, 'post_id': ObjectId(post_id), 'created_at': datetime.datetime.utcnow()})
+    except DuplicateKeyError:
+        return None
+
+    post = database['posts'].find_one_and_update({'_id': ObjectId(post_id)}, counter_update('saves', 1), projection={'saves': 1}, return_document=ReturnDocument.AFTER)
+    if post is None:
+        database['saves'].delete_one({'user_id': user_id, 'post_id': ObjectId(post_id)})
     else:
-        return 'no post found'
+        record_interaction(user_id)
+    return post
+
+def unsave_post_by_id(post_id, user_id):
+    if database['saves'].delete_one({'user_id': user_id, 'post_id': ObjectId(post_id)}).deleted_count == 0:
+        return None
+    post = database['posts'].find_one_and_update({'_id': ObjectId(post_id)}, counter_update('saves', -1), projection={'saves': 1}, return_document=ReturnDocument.AFTER)
+    record_interaction(user_id)
+    return post
+
+# Saves the post if the user hasn't saved it yet, otherwise removes it from their gallery. Returns whether the post is now saved.
+def toggle_save(user_id, post_id):
+    if save_post_by_id(post_id, user_id) is not None:
+        return True
+    unsave_post_by_id(post_id, user_id)
+    return False
 
-def get_favorites_by_ids(favorite_ids):
-    if favorite_ids is None:
-        return []
+# Puts the post in the state the client asked for (saved or not) instead of toggling it, so repeating the request changes nothing.
+# Returns whether the post is now saved.
+def set_save(user_id, post_id, saved):
+    if not saved:
+        unsave_post_by_id(post_id, user_id)
+        return False
+    if save_post_by_id(post_id, user_id) is not None:
+        return True
+    # Already saved, unless the post doesn't exist
+    return bool(get_saved_post_ids(user_id, [ObjectId(post_id)]))
+
+# Like engine. Each like is a small document {user_id, post_id} in the `likes` collection, with a unique index on (user_id, post_id).
+# Inserting or deleting that document decides atomically whether the user liked or unliked the post, then the post's counter (and
+# trending score) is updated in one write which returns the new count, and the count is pushed to the pages showing the post (events.py). Post documents no longer hold the users who like them, so they stay the same size
+# however popular they get, and "did I like these posts" is one indexed lookup (see get_liked_post_ids).
+def like_post_by_id(post_id, user_id):
+    try:
+        database['likes'].insert_one({'user_id': user_id, 'post_id': ObjectId(post_id), 'created_at': datetime.datetime.utcnow()})
+    except DuplicateKeyError:
+        # The user already likes this post
+        return None
+
+    post = database['posts'].find_one_and_update({'_id': ObjectId(post_id)}, counter_update('likes', 1), projection={'likes': 1}, return_document=ReturnDocument.AFTER)
+    if post is None:
+        database['likes'].delete_one({'user_id': user_id, 'post_id': ObjectId(post_id)})
     else:
-        return database['posts'].find({"_id": {"$in": favorite_ids}}).sort("created_at", -1)
+        record_interaction(user_id)
+        publish_like_count(post_id, post['likes'])
+    return post
+
+def unlike_post_by_id(post_id, user_id):
+    if database['likes'].delete_one({'user_id': user_id, 'post_id': ObjectId(post_id)}).deleted_count == 0:
+        # The user doesn't like this post
+        return None
+    post = database['posts'].find_one_and_update({'_id': ObjectId(post_id)}, counter_update('likes', -1), projection={'likes': 1}, return_document=ReturnDocument.AFTER)
+    if post is not None:
+        record_interaction(user_id)
+        publish_like_count(post_id, post['likes'])
+    return post
+
+# Returns which of the given post ids the user likes. The query is answered from the (user_id, post_id) index alone.
+def get_liked_post_ids(user_id, post_ids):
+    return {str(like['post_id']) for like in database['likes'].find({'user_id': user_id, 'post_id': {'$in': list(post_ids)}}, {'_id': 0, 'post_id': 1})}
+
+# Likes the post if the user hasn't liked it yet, otherwise unlikes it. Returns (likes, liked), or None if the post doesn't exist.
+def toggle_like(post_id, user_id):
+    post = like_post_by_id(post_id, user_id)
+    if post:
+        return post['likes'], True
+
+    post = unlike_post_by_id(post_id, user_id)
+    if post:
+        return post['likes'], False
+
+    return None
+
+# Likes or unlikes the post as the client asked instead of toggling it, so repeated or out of date requests don't change anything:
+# when the post is already in that state nothing is written. Returns (likes, liked), or None if the post doesn't exist.
+def set_like(post_id, user_id, liked):
+    post = like_post_by_id(post_id, user_id) if liked else unlike_post_by_id(post_id, user_id)
+    if post is None:
+        post = database['posts'].find_one({'_id': ObjectId(post_id)}, {'likes': 1})
+        if post is None:
+            return None
+    return post.get('likes', 0), liked
+
+# Posts are written with a snapshot of their author (username and avatar_url) so the feeds don't need to look up users at all.
+# This resolves the authors of the posts which don't have an avatar snapshot yet with a single $in query and copies their avatar onto each post.
+def attach_authors(posts):
+    user_ids = {ObjectId(post['user_id']) for post in posts
+                if 'avatar_url' not in post and post.get('user_id') and ObjectId.is_valid(post['user_id'])}
+    if not user_ids:
+        return posts
+
+    authors = {str(user['_id']): user for user in database['users'].find({'_id': {'$in': list(user_ids)}}, {'avatar_url': 1})}
+    for post in posts:
+        author = authors.get(str(post.get('user_id')))
+        if author and 'avatar_url' not in post:
+            post['avatar_url'] = author.get('avatar_url')
+    return posts
+
+# The author snapshot stored on a new post
+def author_snapshot(user):
+    return {'username': user.get('username'), 'avatar_url': user.get('avatar_url')}
+
+# Background job run when a user changes their username or avatar: copies the new values onto all of their posts.
+# The posts are updated in batches (one bulk_write per batch of post ids) so a prolific user never causes one huge write.
+def propagate_author(user_id, fields, batch_size=500):
+    post_ids = [post['_id'] for post in database['posts'].find({'user_id': str(user_id)}, {'_id': 1})]
+    for start in range(0, len(post_ids), batch_size):
+        database['posts'].bulk_write([UpdateMany({'_id': {'$in': post_ids[start:start + batch_size]}}, {'$set': fields})], ordered=False)
+    invalidate_feeds()
+
+# Adds the author snapshot to posts created before snapshots were stored, one bulk_write per batch of users
+def backfill_author_snapshots(batch_size=500):
+    updated = 0
+    batch = []
+    for user in database['users'].find({}, {'username': 1, 'avatar_url': 1}):
+        batch.append(UpdateMany({'user_id': str(user['_id']), 'avatar_url': {'$exists': False}}, {'$set': author_snapshot(user)}))
+        if len(batch) == batch_size:
+            updated += database['posts'].bulk_write(batch, ordered=False).modified_count
+            batch = []
+
+    if batch:
+        updated += database['posts'].bulk_write(batch, ordered=False).modified_count
+    invalidate_feeds()
+    return updated
+
+# Returns which of the given post ids the user saved. Like get_liked_post_ids, this is answered from the (user_id, post_id) index alone.
+def get_saved_post_ids(user_id, post_ids):
+    return {str(save['post_id']) for save in database['saves'].find({'user_id': user_id, 'post_id': {'$in': list(post_ids)}}, {'_id': 0, 'post_id': 1})}
+
+# Returns one page of the user's gallery, most recently saved first, and the cursor for the next page.
+# A single aggregation reads the page of saves from the index and joins their posts, of which only the card fields are sent back.
+# Saves of posts which have been deleted since are dropped from the page and removed from the collection.
+def gallery_page(user_id, cursor=None, limit=PAGE_SIZE):
+    saves = list(database['saves'].aggregate([
+        {'$match': {'user_id': user_id, **cursor_filter(cursor)}},
+        {'$sort': {'created_at': -1, '_id': -1}},
+        {'$limit': limit + 1},
+        {'$lookup': {'from': 'posts', 'localField': 'post_id', 'foreignField': '_id', 'as': 'post'}},
+        {'$project': {'created_at': 1, **{f"post.{field}": 1 for field in CARD_FIELDS}}}
+    ]))
+    saves, next_cursor = next_page(saves, limit)
+
+    dangling = [save['_id'] for save in saves if not save['post']]
+    if dangling:
+        database['saves'].delete_many({'_id': {'$in': dangling}})
+
+    return post_cards(attach_authors([save['post'][0] for save in saves if save['post']])), next_cursor
+
+# Moves the posts saved in the users' favorites arrays (before saves had their own collection) into the saves collection, keeping their
+# order (the arrays hold the most recently saved post first). The arrays are removed. Users are handled in batches.
+def migrate_saves(batch_size=100):
+    migrated = 0
+    users = list(database['users'].find({'favorites': {'$exists': True}}, {'favorites': 1}).limit(batch_size))
+    while users:
+        now = datetime.datetime.utcnow()
+        saves = [{'user_id': str(user['_id']), 'post_id': post_id, 'created_at': now - datetime.timedelta(milliseconds=position)}
+                 for user in users for position, post_id in enumerate(user['favorites'] or [])]
+        if saves:
+            try:
+                database['saves'].insert_many(saves, ordered=False)
+            except BulkWriteError:
+                # Some of these saves were already migrated (or made since), the unique index skips them
+                pass
+
+        database['users'].update_many({'_id': {'$in': [user['_id'] for user in users]}}, {'$unset': {'favorites': ''}})
+        migrated += len(users)
+        users = list(database['users'].find({'favorites': {'$exists': True}}, {'favorites': 1}).limit(batch_size))
+
+    refresh_scores()
+    return migrated
+
+# Returns the like count and the liked / saved state of the session user for a whole page of posts, keyed by post id.
+# This costs one posts query and two index lookups (likes and saves), however many posts are on the page.
+def get_post_states(post_ids, user_id=None):
+    post_ids = [ObjectId(post_id) for post_id in post_ids if ObjectId.is_valid(post_id)]
+    if not post_ids:
+        return {}
+
+    states = {}
+    for post in database['posts'].find({'_id': {'$in': post_ids}}, {'likes': 1}):
+        states[str(post['_id'])] = {'likes': post.get('likes', 0), 'liked': False, 'saved': False}
+
+    if user_id:
+        for post_id in get_liked_post_ids(user_id, post_ids):
+            if post_id in states:
+                states[post_id]['liked'] = True
+        for post_id in get_saved_post_ids(user_id, post_ids):
+            if post_id in states:
+                states[post_id]['saved'] = True
+    return states
+
+# Adds the liked / saved flags of the session user to a page of posts so the templates can render the buttons directly
+def attach_post_states(posts, user_id=None):
+    if not user_id:
+        return posts
+
+    states = get_post_states([post['_id'] for post in posts], user_id)
+    for post in posts:
+        state = states.get(str(post['_id']))
+        if state:
+            post.update(state)
+    return posts
+
+# Moves the likes stored in the posts' users_that_like_post arrays (before likes had their own collection) into the likes collection.
+# The like counts are recomputed from the arrays and the arrays are removed. Posts are handled in batches.
+def migrate_likes(batch_size=500):
+    migrated = 0
+    posts = list(database['posts'].find({'users_that_like_post': {'$exists': True}}, {'users_that_like_post': 1}).limit(batch_size))
+    while posts:
+        likes = [{'user_id': user_id, 'post_id': post['_id'], 'created_at': post['_id'].generation_time.replace(tzinfo=None)}
+                 for post in posts for user_id in set(post['users_that_like_post'] or [])]
+        if likes:
+            try:
+                database['likes'].insert_many(likes, ordered=False)
+            except BulkWriteError:
+                # Some of these likes were already migrated (or made since), the unique index skips them
+                pass
+
+        post_ids = [post['_id'] for post in posts]
+        counts = {count['_id']: count['likes'] for count in database['likes'].aggregate([
+            {'$match': {'post_id': {'$in': post_ids}}},
+            {'$group': {'_id': '$post_id', 'likes': {'$sum': 1}}}
+        ])}
+        database['posts'].bulk_write([UpdateOne({'_id': post_id}, {'$set': {'likes': counts.get(post_id, 0)}, '$unset': {'users_that_like_post': ''}})
+                                      for post_id in post_ids], ordered=False)
+        migrated += len(posts)
+        posts = list(database['posts'].find({'users_that_like_post': {'$exists': True}}, {'users_that_like_post': 1}).limit(batch_size))
+
+    invalidate_feeds()
+    return migrated
+
+# Paging engine shared by every listing route. Pages are keyed on (sort field, _id) instead of skip/offset,
+# so fetching page 100 costs the same as fetching page 1 and no route ever materializes an unbounded cursor.
+# A cursor is an opaque string "<type><value>_<id>" which points at the last document of the previous page.
+def encode_cursor(value, doc_id):
+    if isinstance(value, datetime.datetime):
+        # Mongo stores datetimes with millisecond precision, so this round trips exactly
+        encoded = 'd{}'.format((value.replace(tzinfo=None) - EPOCH) // datetime.timedelta(milliseconds=1))
+    else:
+        encoded = 'n{!r}'.format(float(value or 0))
+    return '{}_{}'.format(encoded, doc_id)
+
+# Returns (value, ObjectId) for a cursor string, or None if the cursor is missing or malformed
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        encoded, doc_id = cursor.rsplit('_', 1)
+        if encoded.startswith('d'):
+            value = EPOCH + datetime.timedelta(milliseconds=int(encoded[1:]))
+        elif encoded.startswith('n'):
+            value = float(encoded[1:])
+        else:
+            return None
+        return value, ObjectId(doc_id)
+    except (ValueError, InvalidId):
+        return None
+
+# The sort fields which hold dates, their cursors are "d" cursors. Every other sort field (e.g. score) is a number.
+DATE_FIELDS = ('created_at',)
+
+# Builds the filter that selects everything strictly after the cursor in descending (field, _id) order
+def cursor_filter(cursor, field='created_at'):
+    decoded = decode_cursor(cursor)
+    if decoded is None:
+        return {}
+    value, doc_id = decoded
+    # A cursor of the other kind (e.g. a date cursor on the trending feed, which is sorted by score) can't be compared with the field,
+    # so it starts from the first page
+    if isinstance(value, datetime.datetime) != (field in DATE_FIELDS):
+        return {}
+    # Equivalent to (field < value) or (field == value and _id < doc_id), but the top level bound lets Mongo use a single index range scan
+    return {field: {'$lte': value}, '$or': [{field: {'$lt': value}}, {'_id': {'$lt': doc_id}}]}
+
+# Given the limit + 1 documents fetched for a page, trims the lookahead document and returns the next cursor (or None on the last page)
+def next_page(docs, limit=PAGE_SIZE, field='created_at'):
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    last = docs[-1]
+    return docs, encode_cursor(last.get(field), last['_id'])
+
+# Returns one bounded page of documents matching query, newest first, and the cursor for the following page.
+# The projection must include the field the page is sorted by.
+def paginate(collection, query, cursor=None, limit=PAGE_SIZE, field='created_at', projection=None):
+    after = cursor_filter(cursor, field)
+    if after:
+        query = {'$and': [query, after]} if query else after
+    docs = list(collection.find(query, projection).sort([(field, -1), ('_id', -1)]).limit(limit + 1))
+    return next_page(docs, limit, field)